@@ -1,21 +1,36 @@
 # agentic_rag.py
 import os
 import time
-from typing import List, Dict, Any
-from ollama import chat    # pip install ollama
-from retrieval import retrieve_and_save, query_collection
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterator
+from llm_scheduler import get_scheduler, INTERACTIVE, BATCH
+from retrieval import retrieve_and_save, query_collection_batch, save_retrieved, embed_query
+from context_packing import pack_context, CONTEXT_TOKEN_BUDGET
+from metrics import stage, start_trace, record_stage, observe_size
+from web_fetch import fetch_web_data
+from artifact_log import artifact_log
+from answer_cache import answer_cache, context_key
 
 # Set the model name you pulled into Ollama. You said: gemma3:1b
 OLLAMA_MODEL = "gemma3:1b"
 
-# Where to write final answers (and short logs)
-ANSWERS_DIR = "answers"
-os.makedirs(ANSWERS_DIR, exist_ok=True)
+# Final answers (with their sources) go to the background artifact log, see artifact_log.py
+
+# Answers generated at the same time by handle_batch
+BATCH_CONCURRENCY = int(os.getenv("AGENTIC_BATCH_CONCURRENCY", "2"))
+
+# What to do when retrieval finds nothing: 'auto' searches the web (cached, with a
+# timeout), 'never' gives up, 'ask' prompts on the terminal (CLI use only)
+WEB_FALLBACK = os.getenv("AGENTIC_WEB_FALLBACK", "auto")
+WEB_TOP_K = 3
 
 class AgenticRAG:
-    def __init__(self, model: str = OLLAMA_MODEL, default_top_k: int = 3):
+    def __init__(self, model: str = OLLAMA_MODEL, default_top_k: int = 3,
+                 context_token_budget: int = CONTEXT_TOKEN_BUDGET, web_fallback: str = WEB_FALLBACK):
         self.model = model
         self.default_top_k = default_top_k
+        self.context_token_budget = context_token_budget
+        self.web_fallback = web_fallback
 
     # 1) Basic query complexity heuristic
     def analyze_query_complexity(self, query: str) -> str:
@@ -81,29 +96,15 @@ class AgenticRAG:
         # system prompt
         system_prompt = (
             "You are an academic assistant. Use ONLY the context provided to answer the user's question. "
-            "When you directly use facts from the provided context, add citations in square brackets like [source:filename_chunkid]. "
+            "When you directly use facts from the provided context, add citations in square brackets like [source:filename_chunkid], "
+            "including the page when the context gives one, e.g. [source:notes.pdf_chunk3 p.12]. "
             "If the context is insufficient to answer fully, say you couldn't find enough information in the user's materials and suggest next steps. "
             "Be concise when asked; otherwise provide detailed explanation with examples when helpful."
         )
 
-        # build context: join retrieved chunks, but keep an overall length limit
-        CONTEXT_CHAR_LIMIT = 6000  # conservative
-        context_parts = []
-        total = 0
-        for r in retrieved:
-            text = r["text"]
-            meta = r["meta"]
-            src = meta.get("source", "unknown")
-            cid = meta.get("chunk_id", "0")
-            header = f"[[{src}_chunk{cid}]]\n"
-            piece = header + text + "\n\n"
-            if total + len(piece) > CONTEXT_CHAR_LIMIT:
-                # leave room for at least a small piece
-                break
-            context_parts.append(piece)
-            total += len(piece)
-
-        context_str = "\n".join(context_parts) if context_parts else "(no relevant context found)"
+        # build context: merge overlapping neighbours, then fill the token budget best-first
+        packed = pack_context(retrieved, self.model, budget_tokens=self.context_token_budget)
+        context_str = packed["context"] if packed["items"] else "(no relevant context found)"
 
         # user prompt: instruct the model to ground answers, show format examples
         user_prompt = (
@@ -122,14 +123,16 @@ class AgenticRAG:
         ]
         return messages
 
-    # 6) Call Ollama for generation (uses the ollama.chat wrapper)
-    def generate_answer(self, messages: List[Dict[str,str]], stream: bool = False) -> str:
+    # 6) Call Ollama for generation (through the shared LLM scheduler)
+    def generate_answer(self, messages: List[Dict[str,str]], stream: bool = False, priority: int = INTERACTIVE):
         """
-        Uses ollama.chat to generate an answer. If stream=True, yields chunks (not implemented in this wrapper).
+        Uses ollama chat (queued by the LLM scheduler) to generate an answer. If stream=True,
+        returns a generator that yields content tokens as Ollama produces them.
         """
-        # Using non-streaming path for simplicity
+        if stream:
+            return self._stream_answer(messages, priority)
         try:
-            response = chat(model=self.model, messages=messages, stream=False)
+            response = get_scheduler().chat(self.model, messages, priority=priority)
             # The response from ollama.chat has response['message']['content']
             content = ""
             if isinstance(response, dict):
@@ -144,12 +147,18 @@ class AgenticRAG:
         except Exception as e:
             return f"[Error calling Ollama: {e}]"
 
-    # 7) Format answer with explicit citations metadata summary and save to disk
+    def _stream_answer(self, messages: List[Dict[str,str]], priority: int = INTERACTIVE) -> Iterator[str]:
+        try:
+            yield from get_scheduler().stream(self.model, messages, priority=priority)
+        except Exception as e:
+            yield f"[Error calling Ollama: {e}]"
+
+    # 7) Format answer with explicit citations metadata summary and log it (written in the background)
     def format_and_save(self, answer_text: str, retrieved: List[Dict[str,Any]], query: str) -> str:
+        """Returns the answer's name, the 'name' field of its record in the artifact log."""
         timestamp = time.strftime("%Y%m%d_%H%M%S")
         safe_query = "_".join(query.strip().split())[:60]
         fname = f"answer_{timestamp}_{safe_query}.txt"
-        outpath = os.path.join(ANSWERS_DIR, fname)
 
         # Build sources list
         sources = []
@@ -157,29 +166,26 @@ class AgenticRAG:
             meta = r["meta"]
             src = meta.get("source", "unknown_source")
             chunk_id = meta.get("chunk_id", "0")
-            sources.append(f"{src}_chunk{chunk_id}")
-
-        with open(outpath, "w", encoding="utf-8") as f:
-            f.write("=== Query ===\n")
-            f.write(query + "\n\n")
-            f.write("=== Answer ===\n")
-            f.write(answer_text + "\n\n")
-            f.write("=== Sources Retrieved ===\n")
-            for s in sources:
-                f.write(f"- {s}\n")
-        return outpath
+            page = meta.get("page")
+            sources.append(f"{src}_chunk{chunk_id} (p.{page})" if page else f"{src}_chunk{chunk_id}")
 
-    # Top-level handler
-    def handle_query(self, query: str, uploaded_file: str | None = None, response_style: str = "concise"):
+        artifact_log.log("answer", {"name": fname, "query": query, "answer": answer_text, "sources": sources})
+        return fname
+
+    # Steps 1-5 of the pipeline, shared by handle_query and handle_query_stream
+    def plan_query(self, query: str, uploaded_file: str | None = None) -> Dict[str, Any]:
         """
-        Orchestrates: analyze -> retrieve -> generate -> format.
-        Returns a dict with {'action': 'answer'|'clarify', 'payload': ...}
+        Steps 1-3: returns {'action': 'clarify', ...} or
+        {'action': 'retrieve', 'top_k': int, 'source_filters': list | None}.
         """
         # 1. detect modality
-        modality = self.detect_input_modality(query, uploaded_file)
+        with stage("agentic", "modality_detection"):
+            modality = self.detect_input_modality(query, uploaded_file)
 
         # 2. ambiguity check
-        if self.is_ambiguous(query):
+        with stage("agentic", "ambiguity_check"):
+            ambiguous = self.is_ambiguous(query)
+        if ambiguous:
             # Minimal clarification prompt — you may implement interactive loop in your UI
             clarify_prompt = "Your question looks ambiguous. Could you briefly say what exactly you want? Examples:\n" \
                              "- 'Define dynamic programming with a short example.'\n" \
@@ -188,35 +194,217 @@ class AgenticRAG:
             return {"action": "clarify", "prompt": clarify_prompt}
 
         # 3. analyze complexity & choose retrieval strategy
-        complexity = self.analyze_query_complexity(query)
-        strategy = self.select_retrieval_strategy(query, complexity)
-        top_k = strategy["top_k"]
-        source_filters = strategy["source_filters"]
+        with stage("agentic", "strategy"):
+            complexity = self.analyze_query_complexity(query)
+            strategy = self.select_retrieval_strategy(query, complexity)
+        return {"action": "retrieve", "top_k": strategy["top_k"], "source_filters": strategy["source_filters"]}
+
+    def build_prepared(self, query: str, retrieved: list, response_style: str = "concise") -> Dict[str, Any]:
+        with stage("agentic", "build_messages"):
+            messages = self.build_messages(query, retrieved, response_style=response_style)
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        observe_size("rag_prompt_chars", prompt_chars, help="Prompt size sent to the LLM", pipeline="agentic")
+        chunks = [(f"{r['meta'].get('source')}_{r['meta'].get('chunk_id')}", r["text"]) for r in retrieved]
+        return {"action": "generate", "retrieved": retrieved, "messages": messages, "prompt_chars": prompt_chars,
+                "cache_key": context_key(self.model, chunks, response_style)}
+
+    # Answer cache (see answer_cache.py): same question, same retrieved chunks -> same answer
+    def cached_answer(self, query: str, prepared: Dict[str, Any]):
+        """{'answer', 'file'} of an earlier answer to this (or a near-identical) question, or None."""
+        if not answer_cache.enabled:
+            return None
+        with stage("agentic", "answer_cache"):
+            return answer_cache.get(prepared["cache_key"], query, embedding=embed_query(query))
+
+    def cache_answer(self, query: str, prepared: Dict[str, Any], answer: str, outpath: str):
+        if not answer_cache.enabled or "[Error calling Ollama" in answer:
+            return
+        sources = {r["meta"].get("source", "unknown_source") for r in prepared["retrieved"]}
+        answer_cache.put(prepared["cache_key"], query, {"answer": answer, "file": outpath},
+                         embedding=embed_query(query), sources=sources)
+
+    def fetch_from_web(self, query: str, policy: str | None = None):
+        """
+        Fallback when retrieval found no usable context. Returns web chunks in the same
+        format as retrieved, or an {'action': 'abort', ...} result.
+        """
+        policy = policy or self.web_fallback
+        if policy == "ask":
+            use_web = input("Do you want to fetch data from the web? (yes/no): ").strip().lower()
+            if use_web != "yes":
+                return {"action": "abort", "message": "User chose not to fetch from web. Cannot answer."}
+        elif policy != "auto":
+            return {"action": "abort", "message": "No relevant content in the uploaded files. Cannot answer."}
+
+        with stage("agentic", "web_fetch"):
+            web_chunks = fetch_web_data(query, top_k=WEB_TOP_K)
+        if not web_chunks:
+            return {"action": "abort", "message": "No relevant content in the uploaded files or on the web."}
+        # Wrap web chunks in the same format as retrieved
+        return [{"file": f"web_chunk{i+1}.txt",
+                 "text": chunk,
+                 "meta": {"source": "web", "chunk_id": str(i+1)}}
+                for i, chunk in enumerate(web_chunks)]
+
+    def prepare_query(self, query: str, uploaded_file: str | None = None, response_style: str = "concise",
+                      web_fallback: str | None = None) -> Dict[str, Any]:
+        """
+        Returns either a final response ({'action': 'clarify'|'abort', ...}) or
+        {'action': 'generate', 'retrieved': [...], 'messages': [...]}.
+        web_fallback overrides the instance's policy ('auto' | 'never' | 'ask').
+        """
+        plan = self.plan_query(query, uploaded_file)
+        if plan["action"] != "retrieve":
+            return plan
+        top_k = plan["top_k"]
+        source_filters = plan["source_filters"]
 
         # 4. retrieval (and save the retrieved chunks to retrieved/)
-        retrieved = retrieve_and_save(query, top_k=top_k, source_filter=source_filters)
+        with stage("agentic", "retrieval"):
+            retrieved = retrieve_and_save(query, top_k=top_k, source_filter=source_filters)
+        observe_size("rag_retrieved_chunks", len(retrieved), help="Chunks returned by retrieval", pipeline="agentic")
 
         # 5. Check if enough context is found
         if not retrieved or len(retrieved) < 1 or all(not r['text'].strip() for r in retrieved):
             # not enough content from uploaded files
             print("⚠️ Lack of content in uploaded file.")
-            use_web = input("Do you want to fetch data from the web? (yes/no): ").strip().lower()
-            if use_web == "yes":
-                from web_fetch import fetch_web_data
-                web_chunks = fetch_web_data(query, top_k=3)
-                # Wrap web chunks in the same format as retrieved
-                retrieved = [{"file": f"web_chunk{i+1}.txt",
-                              "text": chunk,
-                              "meta": {"source": "web", "chunk_id": str(i+1)}}
-                              for i, chunk in enumerate(web_chunks)]
+            retrieved = self.fetch_from_web(query, web_fallback)
+            if isinstance(retrieved, dict):
+                return retrieved
+
+        return self.build_prepared(query, retrieved, response_style)
+
+    # Top-level handler
+    def handle_query(self, query: str, uploaded_file: str | None = None, response_style: str = "concise",
+                     web_fallback: str | None = None):
+        """
+        Orchestrates: analyze -> retrieve -> generate -> format.
+        Returns a dict with {'action': 'answer'|'clarify', 'payload': ...}.
+        Answers carry a 'debug' field with the per-stage timings (ms) and 'cached': True
+        when they came from the answer cache instead of the LLM.
+        """
+        with start_trace() as trace:
+            prepared = self.prepare_query(query, uploaded_file, response_style, web_fallback)
+            if prepared["action"] != "generate":
+                return prepared
+            retrieved = prepared["retrieved"]
+
+            cached = self.cached_answer(query, prepared)
+            if cached is not None:
+                answer, outpath = cached["answer"], cached["file"]
             else:
-                return {"action": "abort", "message": "User chose not to fetch from web. Cannot answer."}
+                # 5. build messages and generate answer
+                with stage("agentic", "generation"):
+                    answer = self.generate_answer(prepared["messages"])
 
-        # 5. build messages and generate answer
-        messages = self.build_messages(query, retrieved, response_style=response_style)
-        answer = self.generate_answer(messages)
+                # 6. format & save
+                with stage("agentic", "format_and_save"):
+                    outpath = self.format_and_save(answer, retrieved, query)
+                self.cache_answer(query, prepared, answer, outpath)
 
-        # 6. format & save
-        outpath = self.format_and_save(answer, retrieved, query)
+        return {"action": "answer", "answer": answer, "sources": [r["meta"] for r in retrieved], "file": outpath,
+                "cached": cached is not None,
+                "debug": {"timings_ms": trace, "retrieved_chunks": len(retrieved),
+                          "prompt_chars": prepared["prompt_chars"]}}
+
+    # Streaming variant of handle_query
+    def handle_query_stream(self, query: str, uploaded_file: str | None = None, response_style: str = "concise",
+                            web_fallback: str | None = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields {'type': 'token', 'content': ...} events as the answer is generated, then one
+        {'type': 'answer', ...} event with the same fields as handle_query plus
+        ttft_ms (time to first token) and total_ms. Clarify/abort results are yielded as-is.
+        """
+        start = time.perf_counter()
+        prepared = self.prepare_query(query, uploaded_file, response_style, web_fallback)
+        if prepared["action"] != "generate":
+            yield prepared
+            return
+        retrieved = prepared["retrieved"]
+
+        cached = self.cached_answer(query, prepared)
+        if cached is not None:
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "answer", "action": "answer", "answer": cached["answer"],
+                   "sources": [r["meta"] for r in retrieved], "file": cached["file"], "cached": True,
+                   "ttft_ms": round((time.perf_counter() - start) * 1000, 1),
+                   "total_ms": round((time.perf_counter() - start) * 1000, 1)}
+            return
+
+        parts = []
+        ttft_ms = None
+        gen_start = time.perf_counter()
+        for token in self.generate_answer(prepared["messages"], stream=True):
+            if ttft_ms is None:
+                ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+            parts.append(token)
+            yield {"type": "token", "content": token}
+        # includes time the consumer spent between tokens; a trace can't span yields
+        record_stage("agentic", "generation", time.perf_counter() - gen_start)
+
+        answer = "".join(parts)
+        with stage("agentic", "format_and_save"):
+            outpath = self.format_and_save(answer, retrieved, query)
+        self.cache_answer(query, prepared, answer, outpath)
+        yield {"type": "answer", "action": "answer", "answer": answer,
+               "sources": [r["meta"] for r in retrieved], "file": outpath, "cached": False,
+               "ttft_ms": ttft_ms, "total_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    # Many questions against the same material (e.g. a question bank)
+    def handle_batch(self, queries: List[str], uploaded_file: str | None = None, response_style: str = "concise",
+                     concurrency: int = BATCH_CONCURRENCY) -> Iterator[Dict[str, Any]]:
+        """
+        Retrieval is batched: queries sharing a retrieval strategy are embedded in one pass
+        and looked up with one vector query. Generation fans out to Ollama, at most
+        `concurrency` answers at a time. Yields one handle_query-style result per query as
+        it completes, with 'index' (position in queries) and 'query'. Queries without
+        context use the web fallback policy, except that 'ask' is treated as 'never'.
+        """
+        web_policy = "never" if self.web_fallback == "ask" else self.web_fallback
+        groups = {}
+        for i, query in enumerate(queries):
+            plan = self.plan_query(query, uploaded_file)
+            if plan["action"] != "retrieve":
+                yield {"index": i, "query": query, **plan}
+                continue
+            key = (plan["top_k"], tuple(plan["source_filters"] or ()))
+            groups.setdefault(key, []).append(i)
+
+        prepared = {}
+        for (top_k, filters), indexes in groups.items():
+            with stage("agentic", "retrieval"):
+                results = query_collection_batch([queries[i] for i in indexes], top_k=top_k,
+                                                 source_filter=list(filters) or None)
+            for i, result in zip(indexes, results):
+                retrieved = save_retrieved(result, queries[i])
+                observe_size("rag_retrieved_chunks", len(retrieved), help="Chunks returned by retrieval", pipeline="agentic")
+                if not any(r["text"].strip() for r in retrieved):
+                    retrieved = self.fetch_from_web(queries[i], web_policy)
+                    if isinstance(retrieved, dict):
+                        yield {"index": i, "query": queries[i], **retrieved}
+                        continue
+                prepared[i] = self.build_prepared(queries[i], retrieved, response_style)
+
+        def answer(i):
+            retrieved = prepared[i]["retrieved"]
+            cached = self.cached_answer(queries[i], prepared[i])
+            if cached is not None:
+                text, outpath = cached["answer"], cached["file"]
+            else:
+                with stage("agentic", "generation"):
+                    text = self.generate_answer(prepared[i]["messages"], priority=BATCH)
+                with stage("agentic", "format_and_save"):
+                    outpath = self.format_and_save(text, retrieved, queries[i])
+                self.cache_answer(queries[i], prepared[i], text, outpath)
+            return {"index": i, "query": queries[i], "action": "answer", "answer": text,
+                    "sources": [r["meta"] for r in retrieved], "file": outpath, "cached": cached is not None}
 
-        return {"action": "answer", "answer": answer, "sources": [r["meta"] for r in retrieved], "file": outpath}
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = [pool.submit(answer, i) for i in prepared]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                # consumer stopped early: don't start the remaining generations
+                for future in futures:
+                    future.cancel()
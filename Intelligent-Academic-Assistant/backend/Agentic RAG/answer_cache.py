@@ -0,0 +1,159 @@
+# answer_cache.py
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from cache_utils import normalize_query
+
+# Generated answers, reused when the same (or a near-identical) question is asked against
+# the same retrieved chunks. The context key hashes the chunk ids *and* texts, so answers
+# built on chunks that re-ingestion changed simply stop matching; invalidate_sources()
+# additionally drops them right away when ingestion/upload runs in this process.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "24")) * 3600
+# Cosine similarity above which a differently-worded question with the same context is a hit
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def context_key(model: str, chunks: list, response_style: str = "", extra: str = "") -> str:
+    """
+    Key for everything besides the question that shapes an answer: model, response style,
+    the retrieved (chunk_id, text) pairs in order, and anything else in the prompt (extra,
+    e.g. chat history).
+    """
+    h = hashlib.sha256(f"{model}|{response_style}|{extra}".encode("utf-8"))
+    for chunk_id, text in chunks:
+        h.update(f"|{chunk_id}:".encode("utf-8"))
+        h.update(hashlib.sha1(text.encode("utf-8")).digest())
+    return h.hexdigest()
+
+
+def _unit(embedding) -> np.ndarray | None:
+    if embedding is None:
+        return None
+    v = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else None
+
+
+class AnswerCache:
+    """
+    Thread-safe LRU of answers with a TTL. Entries are grouped by context key; within a
+    group a lookup matches the normalized question exactly or, given an embedding, the
+    closest cached question with cosine >= similarity.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.enabled = enabled
+        self._entries = OrderedDict()   # (context key, normalized query) -> entry
+        self._by_context = {}           # context key -> set of normalized queries
+        self._by_source = {}            # source -> set of entry keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        queries = self._by_context.get(key[0])
+        if queries is not None:
+            queries.discard(key[1])
+            if not queries:
+                del self._by_context[key[0]]
+        for source in entry["sources"]:
+            keys = self._by_source.get(source)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_source[source]
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry["stored_at"] > self.ttl:
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, ctx: str, query: str, embedding=None):
+        """The cached value for this question + context, or None."""
+        if not self.enabled:
+            return None
+        nq = normalize_query(query)
+        with self._lock:
+            entry = self._live((ctx, nq))
+            if entry is not None:
+                self._entries.move_to_end((ctx, nq))
+                self.hits += 1
+                return entry["value"]
+            vector = _unit(embedding)
+            if vector is not None:
+                best, best_score = None, self.similarity
+                for other in list(self._by_context.get(ctx, ())):
+                    candidate = self._live((ctx, other))
+                    if candidate is None or candidate["embedding"] is None:
+                        continue
+                    score = float(np.dot(vector, candidate["embedding"]))
+                    if score >= best_score:
+                        best, best_score = (ctx, other), score
+                if best is not None:
+                    self._entries.move_to_end(best)
+                    self.hits += 1
+                    self.near_hits += 1
+                    return self._entries[best]["value"]
+            self.misses += 1
+            return None
+
+    def put(self, ctx: str, query: str, value, embedding=None, sources=()):
+        """Store an answer; sources tag it for invalidate_sources() (file names, session ids)."""
+        if not self.enabled:
+            return
+        key = (ctx, normalize_query(query))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {"value": value, "embedding": _unit(embedding),
+                                  "sources": set(sources), "stored_at": time.monotonic()}
+            self._by_context.setdefault(ctx, set()).add(key[1])
+            for source in set(sources):
+                self._by_source.setdefault(source, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_sources(self, sources) -> int:
+        """Drop every answer built on chunks from these sources. Returns how many were dropped."""
+        with self._lock:
+            keys = set()
+            for source in sources:
+                keys |= self._by_source.get(source, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self._by_source.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"enabled": self.enabled, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "near_hits": self.near_hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+answer_cache = AnswerCache()
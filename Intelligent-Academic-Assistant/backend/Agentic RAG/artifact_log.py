@@ -0,0 +1,152 @@
+# artifact_log.py
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import threading
+
+# Retrieved chunks and answers are appended to gzip-compressed JSONL segments by a
+# background thread instead of one file per chunk/answer on the request path.
+# ARTIFACT_LOG=0 turns the log off entirely.
+ARTIFACT_LOG_ENABLED = os.getenv("ARTIFACT_LOG", "1") == "1"
+ARTIFACT_LOG_DIR = os.getenv("ARTIFACT_LOG_DIR", "artifacts")
+ARTIFACT_SEGMENT_BYTES = int(float(os.getenv("ARTIFACT_SEGMENT_MB", "16")) * 1024 * 1024)
+ARTIFACT_MAX_SEGMENTS = int(os.getenv("ARTIFACT_MAX_SEGMENTS", "20"))  # oldest are deleted
+ARTIFACT_FLUSH_SECONDS = float(os.getenv("ARTIFACT_FLUSH_SECONDS", "1.0"))
+ARTIFACT_BATCH_SIZE = 512
+ARTIFACT_QUEUE_SIZE = 10000  # records beyond this are dropped (and counted), never waited on
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+class ArtifactLog:
+    """
+    Non-blocking artifact sink. log() only enqueues; a daemon thread drains the queue
+    every ARTIFACT_FLUSH_SECONDS (or ARTIFACT_BATCH_SIZE records) and appends the batch
+    as one gzip member to the current segment. Segments rotate at ARTIFACT_SEGMENT_BYTES
+    and only the newest ARTIFACT_MAX_SEGMENTS are kept.
+    """
+
+    def __init__(self, directory: str = ARTIFACT_LOG_DIR, enabled: bool = ARTIFACT_LOG_ENABLED,
+                 segment_bytes: int = ARTIFACT_SEGMENT_BYTES, max_segments: int = ARTIFACT_MAX_SEGMENTS,
+                 flush_seconds: float = ARTIFACT_FLUSH_SECONDS):
+        self.directory = directory
+        self.enabled = enabled
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=ARTIFACT_QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._segment = None
+        self._seq = 0
+        self.written = 0
+        self.dropped = 0
+
+    def log(self, kind: str, record: dict):
+        """Queue a record ({'type': kind, 'ts': ..., **record}); returns immediately."""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait({"type": kind, "ts": time.time(), **record})
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name="artifact-log", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _next_batch(self) -> list:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_seconds))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < ARTIFACT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _segment_path(self) -> str:
+        if self._segment is None or not os.path.exists(self._segment) \
+                or os.path.getsize(self._segment) >= self.segment_bytes:
+            self._seq += 1
+            name = f"artifacts-{time.strftime('%Y%m%d_%H%M%S')}-{os.getpid()}-{self._seq:04d}{SEGMENT_SUFFIX}"
+            self._segment = os.path.join(self.directory, name)
+            self._prune()
+        return self._segment
+
+    def _prune(self):
+        segments = list_segments(self.directory)
+        for path in segments[:max(0, len(segments) - self.max_segments + 1)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _write(self, batch: list):
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch).encode("utf-8")
+        try:
+            with gzip.open(self._segment_path(), "ab") as f:
+                f.write(data)
+            self.written += len(batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            print(f"⚠️ Artifact log write failed: {e}")
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (up to timeout) until everything queued so far is on disk."""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "queued": self._queue.qsize(),
+                "written": self.written, "dropped": self.dropped}
+
+
+def list_segments(directory: str = ARTIFACT_LOG_DIR) -> list:
+    """Segment paths, oldest first."""
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith(SEGMENT_SUFFIX)]
+    except OSError:
+        return []
+    paths = [os.path.join(directory, n) for n in names]
+    return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+
+def read_records(directory: str = ARTIFACT_LOG_DIR, kind: str | None = None):
+    """Iterate logged records (oldest first), optionally only one type."""
+    for path in list_segments(directory):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if kind is None or record.get("type") == kind:
+                    yield record
+
+
+artifact_log = ArtifactLog()
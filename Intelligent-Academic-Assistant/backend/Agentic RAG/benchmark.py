@@ -0,0 +1,313 @@
+# benchmark.py
+"""
+Reproducible benchmark for ingestion, retrieval and end-to-end QA.
+
+Builds a synthetic PDF corpus (seeded, so every run sees the same text), optionally
+adds real sample PDFs, starts fake_ollama.py as a stand-in for Ollama and web search
+and runs everything in a throwaway workspace. Results are written as JSON so runs can be compared.
+
+Usage:
+    python benchmark.py --size small
+    python benchmark.py --size medium --sample-dir ~/course_pdfs --concurrency 8
+    python benchmark.py --size small --compare bench_results/20250101_120000.json
+    python benchmark.py --size small --rerank --compare bench_results/<run without --rerank>.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+# (number of PDFs, pages per PDF)
+CORPUS_SIZES = {
+    "small": (5, 10),
+    "medium": (20, 50),
+    "large": (50, 200),
+}
+WORDS_PER_PAGE = 350
+
+VOCAB = (
+    "algorithm complexity recurrence dynamic programming graph shortest path dijkstra bellman ford "
+    "matrix eigenvalue vector space linear transformation theorem proof lemma corollary induction "
+    "probability distribution variance expectation entropy compiler parser grammar automaton "
+    "turing machine decidable reduction np-complete heuristic greedy divide conquer sorting heap "
+    "hash table binary search tree balanced red-black b-tree database normalization transaction "
+    "lecture syllabus assignment exam outcome module week reading cs-101 ma-201 ee-310 o(n) o(log n)"
+).split()
+
+QUERIES = [
+    "What is dynamic programming?",
+    "Explain dijkstra shortest path algorithm",
+    "What is a red-black tree?",
+    "Define entropy in probability",
+    "Compare greedy and divide and conquer approaches with an example",
+    "What topics does the cs-101 syllabus cover?",
+    "How does a compiler parser use a grammar?",
+    "Summarize the lecture on hash table collisions",
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def latency_summary(seconds: list) -> dict:
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 2) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+    }
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def build_synthetic_corpus(data_dir: str, n_pdfs: int, n_pages: int, seed: int = 42):
+    import fitz
+    rng = random.Random(seed)
+    # names matter: definition queries filter on "syllabus" / "notes" / "lecture"
+    kinds = ["syllabus", "lecture_notes", "notes", "exam", "assignment"]
+    for i in range(n_pdfs):
+        doc = fitz.open()
+        for _ in range(n_pages):
+            page = doc.new_page()
+            text = " ".join(rng.choice(VOCAB) for _ in range(WORDS_PER_PAGE))
+            page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=8)
+        doc.save(os.path.join(data_dir, f"{kinds[i % len(kinds)]}_{i:03d}.pdf"))
+        doc.close()
+
+
+def bench_embedder(embedder, rounds: int) -> dict:
+    """Cold start (model load + first encode) and per-query embedding latency."""
+    start = time.perf_counter()
+    embedder.encode([QUERIES[0]])
+    cold_secs = time.perf_counter() - start
+    per_query = []
+    for _ in range(rounds):
+        for q in QUERIES:
+            start = time.perf_counter()
+            embedder.encode([q])
+            per_query.append(time.perf_counter() - start)
+    return {**embedder.embedder_stats(), "cold_start_seconds": round(cold_secs, 3),
+            "query": latency_summary(per_query)}
+
+
+def bench_ingestion(ingestion_indexing) -> dict:
+    start = time.perf_counter()
+    ingestion_indexing.ingest_pdfs(incremental=False)
+    full_secs = time.perf_counter() - start
+    n_chunks = ingestion_indexing.collection.count()
+
+    # second run: nothing changed, should be a manifest-only pass
+    start = time.perf_counter()
+    ingestion_indexing.ingest_pdfs(incremental=True)
+    incremental_secs = time.perf_counter() - start
+
+    return {
+        "chunks": n_chunks,
+        "seconds": round(full_secs, 3),
+        "chunks_per_sec": round(n_chunks / full_secs, 1) if full_secs else 0.0,
+        "incremental_noop_seconds": round(incremental_secs, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_retrieval(retrieval, rounds: int, top_k: int) -> dict:
+    cold, warm = [], []
+    for _ in range(rounds):
+        for q in QUERIES:
+            retrieval.clear_caches()
+            start = time.perf_counter()
+            retrieval.query_collection(q, top_k=top_k)
+            cold.append(time.perf_counter() - start)
+    for _ in range(rounds):
+        for q in QUERIES:
+            start = time.perf_counter()
+            retrieval.query_collection(q, top_k=top_k)
+            warm.append(time.perf_counter() - start)
+    return {"cold": latency_summary(cold), "warm": latency_summary(warm),
+            "cache_stats": retrieval.cache_stats(), "rerank": retrieval.rerank_stats(),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_end_to_end(agentic_rag, answer_cache, n_requests: int, concurrency: int, cached: bool = False) -> dict:
+    """
+    cached=False measures the whole pipeline with the answer cache off (the query set
+    repeats, so otherwise everything after the first pass would be a hit). cached=True
+    primes the cache with one pass over QUERIES and measures the hit path.
+    """
+    answer_cache.clear()
+    answer_cache.enabled = cached
+    agent = agentic_rag.AgenticRAG()
+    if cached:
+        for q in QUERIES:
+            agent.handle_query(q)
+
+    def one(i):
+        start = time.perf_counter()
+        resp = agent.handle_query(QUERIES[i % len(QUERIES)])
+        return time.perf_counter() - start, resp.get("action"), bool(resp.get("cached"))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n_requests)))
+    wall = time.perf_counter() - start
+
+    latencies = [secs for secs, _, _ in results]
+    actions = {}
+    for _, action, _ in results:
+        actions[action] = actions.get(action, 0) + 1
+    return {
+        "answer_cache": cached,
+        "cached_responses": sum(hit for _, _, hit in results),
+        "answer_cache_stats": answer_cache.stats(),
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(n_requests / wall, 2) if wall else 0.0,
+        "latency": latency_summary(latencies),
+        "actions": actions,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(old: dict, new: dict):
+    """Print the headline numbers of two result files side by side."""
+    rows = [
+        ("embedder cold start s", ("embedder", "cold_start_seconds")),
+        ("embed query p50 ms", ("embedder", "query", "p50_ms")),
+        ("ingestion chunks/sec", ("ingestion", "chunks_per_sec")),
+        ("retrieval cold p50 ms", ("retrieval", "cold", "p50_ms")),
+        ("retrieval cold p95 ms", ("retrieval", "cold", "p95_ms")),
+        ("retrieval warm p50 ms", ("retrieval", "warm", "p50_ms")),
+        ("rerank mean ms", ("retrieval", "rerank", "mean_ms")),
+        ("rerank tokens saved", ("retrieval", "rerank", "tokens_saved")),
+        ("e2e p50 ms", ("end_to_end", "latency", "p50_ms")),
+        ("e2e p95 ms", ("end_to_end", "latency", "p95_ms")),
+        ("e2e throughput rps", ("end_to_end", "throughput_rps")),
+        ("e2e cached p50 ms", ("end_to_end_cached", "latency", "p50_ms")),
+        ("peak RSS MB", ("peak_rss_mb",)),
+    ]
+
+    def dig(d, path):
+        for p in path:
+            d = d.get(p, {}) if isinstance(d, dict) else {}
+        return d if isinstance(d, (int, float)) else None
+
+    print(f"{'metric':<24}{'old':>12}{'new':>12}{'change':>10}")
+    for name, path in rows:
+        a, b = dig(old, path), dig(new, path)
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "n/a"
+        print(f"{name:<24}{a if a is not None else '-':>12}{b if b is not None else '-':>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and end-to-end QA")
+    parser.add_argument("--size", choices=sorted(CORPUS_SIZES), default="small")
+    parser.add_argument("--sample-dir", help="also ingest the PDFs in this directory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rounds", type=int, default=5, help="retrieval passes over the query set")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=32, help="end-to-end requests")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0, help="fake Ollama generation rate")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per fake answer")
+    parser.add_argument("--out", default=os.path.join(HERE, "bench_results"))
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    parser.add_argument("--rerank", action="store_true", help="enable the cross-encoder re-ranking stage")
+    parser.add_argument("--keep-workspace", action="store_true")
+    args = parser.parse_args()
+
+    out_dir = os.path.abspath(args.out)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workspace = tempfile.mkdtemp(prefix="agentic_rag_bench_")
+    from fake_ollama import start_fake_ollama
+    server, ollama_url = start_fake_ollama(tokens_per_sec=args.tokens_per_sec, n_tokens=args.tokens)
+    # must be set before the ollama package builds its default client
+    os.environ["OLLAMA_HOST"] = ollama_url
+    # web fallback searches go to the same stand-in, never to the real search service
+    os.environ["WEB_SEARCH_BACKEND"] = "http"
+    os.environ["WEB_SEARCH_URL"] = ollama_url + "/search"
+    os.environ["RERANK"] = "1" if args.rerank else "0"
+    # end-to-end numbers are measured without the answer cache (see bench_end_to_end)
+    os.environ["ANSWER_CACHE"] = "0"
+
+    cwd = os.getcwd()
+    try:
+        # the pipeline uses paths relative to the working directory (data/, agentic_rag_db/, ...)
+        os.chdir(workspace)
+        os.makedirs("data")
+        n_pdfs, n_pages = CORPUS_SIZES[args.size]
+        print(f"📚 Building {args.size} corpus: {n_pdfs} PDFs x {n_pages} pages")
+        build_synthetic_corpus("data", n_pdfs, n_pages, seed=args.seed)
+        if args.sample_dir:
+            for name in os.listdir(args.sample_dir):
+                if name.endswith(".pdf"):
+                    shutil.copy(os.path.join(args.sample_dir, name), os.path.join("data", name))
+
+        start = time.perf_counter()
+        import ingestion_indexing
+        import retrieval
+        import agentic_rag
+        import embedder
+        from answer_cache import answer_cache
+        import_secs = time.perf_counter() - start
+
+        results = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {**vars(args), "python": platform.python_version(), "platform": platform.platform(),
+                       "cpu_count": os.cpu_count()},
+            "import_seconds": round(import_secs, 3),
+        }
+        print("⏱️ Embedder...")
+        results["embedder"] = bench_embedder(embedder, args.rounds)
+        print("⏱️ Ingestion...")
+        results["ingestion"] = bench_ingestion(ingestion_indexing)
+        print("⏱️ Retrieval...")
+        results["retrieval"] = bench_retrieval(retrieval, args.rounds, args.top_k)
+        print("⏱️ End-to-end QA...")
+        results["end_to_end"] = bench_end_to_end(agentic_rag, answer_cache, args.requests, args.concurrency)
+        print("⏱️ End-to-end QA (answer cache hits)...")
+        results["end_to_end_cached"] = bench_end_to_end(agentic_rag, answer_cache, args.requests,
+                                                        args.concurrency, cached=True)
+        results["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+        if not args.keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, time.strftime("%Y%m%d_%H%M%S") + f"_{args.size}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"💾 Saved {out_path}")
+
+    if compare_path:
+        with open(compare_path, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bm25_index.py
+import os
+import re
+import math
+import pickle
+from collections import Counter
+
+# Persistent inverted index stored next to the Chroma files
+BM25_INDEX_NAME = "bm25_index.pkl"
+
+# Keep course codes / symbols like "cs-101", "o(n)", "x_1", "c++" together as one term
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._\-+#][a-z0-9+#]+)*\+*")
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+
+def bm25_index_path(db_dir: str) -> str:
+    return os.path.join(db_dir, BM25_INDEX_NAME)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over chunk ids. Supports incremental add/remove so ingest_pdfs can
+    keep it in sync with the academic_materials collection.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}     # term -> {doc_id: term frequency}
+        self.doc_terms = {}    # doc_id -> list of distinct terms (needed for removal)
+        self.doc_len = {}      # doc_id -> number of tokens
+        self.doc_source = {}   # doc_id -> source filename
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, doc_id: str, text: str, source: str = ""):
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_terms[doc_id] = list(counts)
+        self.doc_len[doc_id] = len(tokens)
+        self.doc_source[doc_id] = source
+        self.total_len += len(tokens)
+
+    def remove(self, doc_id: str):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+        self.doc_source.pop(doc_id, None)
+
+    def search(self, query: str, top_k: int = 10, source_pred=None) -> list:
+        """Return [(doc_id, score), ...] best first. source_pred(source) restricts the candidates."""
+        n_docs = len(self.doc_len)
+        if n_docs == 0:
+            return []
+        avg_len = self.total_len / n_docs
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        if source_pred is not None:
+            scores = {d: s for d, s in scores.items() if source_pred(self.doc_source.get(d, ""))}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def save(self, path: str):
+        """Atomic write so a crashed ingest never leaves a truncated index."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                index.__dict__.update(pickle.load(f))
+        return index
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """Fuse several ranked id lists into one (RRF). Returns ids, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
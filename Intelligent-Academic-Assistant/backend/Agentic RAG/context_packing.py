@@ -0,0 +1,194 @@
+# context_packing.py
+import os
+import re
+import threading
+
+# Prompt budget for retrieved context, in tokens of the target model
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Hugging Face tokenizer matching each Ollama model family. These are ungated copies of
+# the official tokenizers (google/ and meta-llama/ need an access token); CONTEXT_TOKENIZER
+# overrides the choice with another repo or a local directory. If it can't be loaded
+# (offline, no transformers) we fall back to an estimate, and say so once.
+MODEL_TOKENIZERS = {
+    "gemma3": "unsloth/gemma-3-1b-it",
+    "gemma2": "unsloth/gemma-2-2b-it",
+    "llama3": "unsloth/llama-3-8b-Instruct",
+    "qwen2.5": "Qwen/Qwen2.5-0.5B-Instruct",
+}
+
+# Longest overlap looked for when stitching adjacent chunks (words)
+MAX_OVERLAP_WORDS = 300
+
+
+class TokenCounter:
+    """
+    Counts tokens with the model's own tokenizer when available, else ~4 chars/token.
+    Loading may download the tokenizer: create it off the event loop (warm_up_tokenizers).
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.tokenizer = None
+        name = os.getenv("CONTEXT_TOKENIZER") or MODEL_TOKENIZERS.get(model.split(":")[0])
+        if not name:
+            print(f"⚠️ No tokenizer known for {model}; estimating token counts.")
+            return
+        try:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(name)
+        except Exception as e:
+            print(f"⚠️ Tokenizer {name} unavailable ({e}); estimating token counts for {model}.")
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return len(text) // 4 + 1
+
+
+_counters = {}
+_counter_locks = {}   # model -> lock held while its tokenizer loads
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """
+    One counter per model, created once (so a fallback is only reported once). Loading
+    holds only that model's lock, so a slow download never blocks the other models.
+    """
+    counter = _counters.get(model)
+    if counter is not None:
+        return counter
+    with _counters_lock:
+        lock = _counter_locks.setdefault(model, threading.Lock())
+    with lock:
+        if model not in _counters:
+            _counters[model] = TokenCounter(model)
+        return _counters[model]
+
+
+def warm_up_tokenizers(models: list):
+    """Load the tokenizers for models ahead of the first request (e.g. on server startup)."""
+    for model in models:
+        counter = get_token_counter(model)
+        if counter.exact:
+            print(f"🔤 Tokenizer ready for {model}")
+
+
+def _chunk_index(meta: dict):
+    try:
+        return int(meta.get("chunk_id"))
+    except (TypeError, ValueError):
+        return None
+
+
+def stitch(prev_text: str, next_text: str) -> str:
+    """Join two adjacent chunks, dropping the words they share (suffix of prev == prefix of next)."""
+    prev_words = prev_text.split()
+    next_words = next_text.split()
+    longest = min(len(prev_words), len(next_words), MAX_OVERLAP_WORDS)
+    for k in range(longest, 0, -1):
+        if prev_words[-k:] == next_words[:k]:
+            return " ".join(prev_words + next_words[k:])
+    return prev_text + "\n" + next_text
+
+
+def merge_overlapping(retrieved: list) -> list:
+    """
+    Merge chunks that are neighbours in the same source (consecutive chunk_ids) into one
+    passage without the duplicated overlap, and drop exact duplicates. Each merged item
+    keeps the best (lowest) retrieval rank of its parts.
+    Returns [{'source', 'chunk_ids', 'text', 'rank', 'meta'}, ...] ordered by rank.
+    """
+    items, seen_texts = [], set()
+    for rank, r in enumerate(retrieved):
+        text = r["text"].strip()
+        if not text or text in seen_texts:
+            continue
+        seen_texts.add(text)
+        meta = r.get("meta") or {}
+        items.append({"source": meta.get("source", "unknown"), "index": _chunk_index(meta),
+                      "chunk_ids": [meta.get("chunk_id", "0")], "text": text, "rank": rank, "meta": meta})
+
+    merged = []
+    by_source = {}
+    for item in items:
+        by_source.setdefault(item["source"], []).append(item)
+    for group in by_source.values():
+        numbered = sorted((i for i in group if i["index"] is not None), key=lambda i: i["index"])
+        merged.extend(i for i in group if i["index"] is None)
+        current = None
+        for item in numbered:
+            if current is not None and item["index"] == current["index"] + 1:
+                current["text"] = stitch(current["text"], item["text"])
+                current["chunk_ids"].append(item["chunk_ids"][0])
+                current["index"] = item["index"]
+                current["rank"] = min(current["rank"], item["rank"])
+            else:
+                current = dict(item, chunk_ids=list(item["chunk_ids"]))
+                merged.append(current)
+    return sorted(merged, key=lambda i: i["rank"])
+
+
+def truncate_to_budget(text: str, counter: TokenCounter, budget_tokens: int, suffix: str = "") -> str:
+    """
+    Longest prefix of text, cut at a word boundary, such that prefix + suffix counts as at
+    most budget_tokens ("" if not even one word fits). Binary search on the real count, so
+    unevenly dense text (code, numbers, symbols) still ends up within the budget.
+    """
+    ends = [m.end() for m in re.finditer(r"\S+", text)]
+    lo, hi = 0, len(ends)   # the first lo words are known to fit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if counter.count(text[:ends[mid - 1]] + suffix) <= budget_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:ends[lo - 1]] + suffix if lo else ""
+
+
+def default_header(item: dict) -> str:
+    ids = item["chunk_ids"]
+    cid = ids[0] if len(ids) == 1 else f"{ids[0]}-{ids[-1]}"
+    page = item["meta"].get("page")
+    return f"[[{item['source']}_chunk{cid} p.{page}]]\n" if page else f"[[{item['source']}_chunk{cid}]]\n"
+
+
+def pack_context(retrieved: list, model: str, budget_tokens: int = CONTEXT_TOKEN_BUDGET,
+                 header_fn=default_header) -> dict:
+    """
+    Fill budget_tokens with retrieved passages best-first: overlapping neighbours are
+    merged, passages that don't fit are skipped (not a hard stop), and if even the best
+    passage is too long it is truncated to the budget.
+    Returns {'context': str, 'items': [...], 'tokens': int, 'dropped': int}.
+    """
+    counter = get_token_counter(model)
+    items = merge_overlapping(retrieved)
+    selected, used, dropped = [], 0, 0
+    for item in items:
+        piece = (header_fn(item) if header_fn else "") + item["text"] + "\n\n"
+        tokens = counter.count(piece)
+        if used + tokens <= budget_tokens:
+            selected.append((item, piece))
+            used += tokens
+        elif not selected:
+            # best passage alone is over budget: keep the head that fits
+            piece = truncate_to_budget(piece, counter, budget_tokens, suffix="\n\n")
+            if piece:
+                selected.append((item, piece))
+                used += counter.count(piece)
+            else:
+                dropped += 1
+        else:
+            dropped += 1
+
+    return {
+        "context": "".join(piece for _, piece in selected),   # pieces end in a blank line
+        "items": [item for item, _ in selected],
+        "tokens": used,
+        "dropped": dropped,
+    }
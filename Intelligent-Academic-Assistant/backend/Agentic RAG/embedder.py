@@ -0,0 +1,103 @@
+# embedder.py
+import os
+import time
+import threading
+import numpy as np
+
+# One sentence-transformers model per process, shared by ingestion and retrieval and
+# loaded on first use (importing a module no longer pays for it).
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# 'torch' (default), 'int8' (dynamically quantized Linear layers, CPU) or 'onnx'
+# (ONNX Runtime via sentence-transformers' onnx backend; needs optimum[onnxruntime])
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "torch").lower()
+# CPU threads for inference (0 = library default)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+
+# Cross-encoder used by retrieval's optional re-ranking stage (also loaded on first use)
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+
+_model = None
+_cross_encoder = None
+_backend = None
+_load_seconds = None
+_lock = threading.Lock()
+
+
+def _load(backend: str):
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        return SentenceTransformer(EMBED_MODEL, device="cpu", backend="onnx")
+    if backend == "int8":
+        import torch
+        model = SentenceTransformer(EMBED_MODEL, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return SentenceTransformer(EMBED_MODEL)
+
+
+def get_embedder():
+    """The shared model, loaded once (thread-safe). Falls back to torch if the backend can't load."""
+    global _model, _backend, _load_seconds
+    if _model is None:
+        with _lock:
+            if _model is None:
+                start = time.perf_counter()
+                if EMBED_THREADS:
+                    import torch
+                    torch.set_num_threads(EMBED_THREADS)
+                backend = EMBEDDER_BACKEND
+                try:
+                    model = _load(backend)
+                except Exception as e:
+                    if backend == "torch":
+                        raise
+                    print(f"⚠️ Embedder backend '{backend}' unavailable ({e}); using torch.")
+                    backend = "torch"
+                    model = _load(backend)
+                _backend = backend
+                _load_seconds = time.perf_counter() - start
+                _model = model
+                print(f"🧠 Loaded {EMBED_MODEL} ({backend}) in {_load_seconds:.2f}s")
+    return _model
+
+
+def model_id() -> str:
+    """Identifies the vectors produced here (for cache keys): quantized vectors differ slightly."""
+    backend = _backend or EMBEDDER_BACKEND
+    return EMBED_MODEL if backend == "torch" else f"{EMBED_MODEL}:{backend}"
+
+
+def encode(texts: list, batch_size: int | None = None) -> np.ndarray:
+    """Embed a list of texts, batch_size at a time. Returns a float32 (n, dim) array."""
+    model = get_embedder()
+    vectors = model.encode(list(texts), batch_size=batch_size or EMBED_BATCH_SIZE,
+                           convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def embedder_stats() -> dict:
+    return {"model": EMBED_MODEL, "backend": _backend or EMBEDDER_BACKEND, "loaded": _model is not None,
+            "load_seconds": round(_load_seconds, 3) if _load_seconds is not None else None}
+
+
+def get_cross_encoder():
+    """The shared re-ranking cross-encoder (CPU), loaded once."""
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _lock:
+            if _cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+                start = time.perf_counter()
+                _cross_encoder = CrossEncoder(RERANK_MODEL, device="cpu")
+                print(f"🧠 Loaded {RERANK_MODEL} in {time.perf_counter() - start:.2f}s")
+    return _cross_encoder
+
+
+def score_pairs(pairs: list, batch_size: int | None = None) -> list:
+    """Relevance scores for (query, passage) pairs, one forward pass per batch."""
+    if not pairs:
+        return []
+    scores = get_cross_encoder().predict(pairs, batch_size=batch_size or RERANK_BATCH_SIZE,
+                                         show_progress_bar=False)
+    return [float(s) for s in scores]
@@ -0,0 +1,132 @@
+# fake_ollama.py
+"""
+Local stand-in for the Ollama HTTP API, used by benchmark.py (and handy for manual tests).
+Answers /api/chat and /api/generate with canned tokens at a fixed rate, streamed or not,
+and GET /search with canned results for web_fetch's 'http' backend.
+
+Usage:
+    python fake_ollama.py --port 11435 --tokens-per-sec 40 --tokens 64
+    OLLAMA_HOST=http://127.0.0.1:11435 python quick_test.py
+"""
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_TEXT = (
+    "Based on the provided context, dynamic programming breaks a problem into overlapping "
+    "subproblems and stores their solutions [source:notes.pdf_chunk0]. "
+)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    # set by make_server
+    tokens_per_sec = 40.0
+    n_tokens = 64
+    ttft = 0.05
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _tokens(self):
+        words = CANNED_TEXT.split(" ")
+        return [words[i % len(words)] + " " for i in range(self.n_tokens)]
+
+    def _payload(self, model: str, chat: bool, content: str, done: bool) -> dict:
+        payload = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+        if chat:
+            payload["message"] = {"role": "assistant", "content": content}
+        else:
+            payload["response"] = content
+        if done:
+            payload.update({"done_reason": "stop", "eval_count": self.n_tokens,
+                            "eval_duration": int(self.n_tokens / self.tokens_per_sec * 1e9)})
+        return payload
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/search":
+            params = parse_qs(url.query)
+            query = params.get("q", [""])[0]
+            n = int(params.get("n", ["3"])[0])
+            self._send_json({"results": [{"title": f"Result {i + 1}", "body": f"{query}: {CANNED_TEXT}"}
+                                         for i in range(n)]})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": "gemma3:1b", "model": "gemma3:1b"}]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        else:
+            self._send_json({"status": "Ollama is running"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json({"error": f"unsupported path {self.path}"}, status=404)
+            return
+
+        chat = self.path == "/api/chat"
+        model = request.get("model", "fake")
+        delay = 1.0 / self.tokens_per_sec
+        # an empty generate is Ollama's "load the model" call: answer right away
+        if not chat and not request.get("prompt"):
+            self._send_json(self._payload(model, chat, "", True))
+            return
+
+        time.sleep(self.ttft)
+        if not request.get("stream", True):
+            time.sleep(delay * self.n_tokens)
+            self._send_json(self._payload(model, chat, "".join(self._tokens()), True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in self._tokens():
+            self.wfile.write((json.dumps(self._payload(model, chat, token, False)) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(delay)
+        self.wfile.write((json.dumps(self._payload(model, chat, "", True)) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, tokens_per_sec: float = 40.0,
+                n_tokens: int = 64, ttft: float = 0.05) -> ThreadingHTTPServer:
+    handler = type("ConfiguredFakeOllama", (FakeOllamaHandler,), {
+        "tokens_per_sec": tokens_per_sec, "n_tokens": n_tokens, "ttft": ttft,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_fake_ollama(**kwargs):
+    """Start the server in a daemon thread. Returns (server, base_url)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama server returning canned tokens")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per answer")
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    args = parser.parse_args()
+    srv = make_server(args.host, args.port, args.tokens_per_sec, args.tokens, args.ttft)
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    srv.serve_forever()
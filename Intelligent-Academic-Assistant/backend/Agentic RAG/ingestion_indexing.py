@@ -1,7 +1,13 @@
 import os
-import fitz  # PyMuPDF for PDF parsing
-from sentence_transformers import SentenceTransformer
+import time
+import argparse
 import chromadb
+from embedder import encode, model_id, EMBED_BATCH_SIZE
+from upload_cache import UploadCache, cache_key, sha256_file
+from manifest import load_manifest, save_manifest, chunk_ids
+from pdf_extract import iter_page_texts, iter_page_chunks  # PyMuPDF pages, parsed in parallel
+from bm25_index import BM25Index, bm25_index_path
+from answer_cache import answer_cache
 
 # Paths
 DATA_DIR = "data"
@@ -11,41 +17,159 @@ DB_DIR = "agentic_rag_db"
 client = chromadb.PersistentClient(path=DB_DIR)
 collection = client.get_or_create_collection("academic_materials")
 
-# Load embedding model
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+# Chunking parameters (the embedding model is shared and loaded lazily, see embedder.py)
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
 
-def pdf_to_chunks(pdf_path, chunk_size=500, overlap=50):
+# Reuse chunks + embeddings of PDFs we've already processed
+upload_cache = UploadCache()
+
+# Save manifest + BM25 index after this many re-ingested files (and at the end)
+CHECKPOINT_EVERY = 25
+
+def iter_pdf_chunks(pdf_path, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Stream {'text', 'page', 'page_end', 'char_offset'} chunks page by page; memory stays flat."""
+    return iter_page_chunks(iter_page_texts(pdf_path, engine="pymupdf"), chunk_size, overlap)
+
+def pdf_to_chunks(pdf_path, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     """Convert PDF into text chunks for embedding"""
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text("text")
-
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-    return chunks
-
-def ingest_pdfs():
-    for file in os.listdir(DATA_DIR):
-        if file.endswith(".pdf"):
-            pdf_path = os.path.join(DATA_DIR, file)
-            chunks = pdf_to_chunks(pdf_path)
-            embeddings = embedder.encode(chunks).tolist()
-
-            ids = [f"{file}_{i}" for i in range(len(chunks))]
-            metadatas = [{"source": file, "chunk_id": i} for i in range(len(chunks))]
-
-            collection.add(
-                ids=ids,
-                documents=chunks,
-                embeddings=embeddings,
-                metadatas=metadatas
-            )
-            print(f"✅ Ingested {file} with {len(chunks)} chunks.")
+    return [chunk["text"] for chunk in iter_pdf_chunks(pdf_path, chunk_size, overlap)]
 
-if __name__ == "__main__":
-    ingest_pdfs()
+def build_chunks(pdf_path):
+    """
+    Chunk + embed a PDF, going through the upload cache.
+    Returns (chunks, embeddings, page_metas, from_cache); page_metas holds page/page_end/char_offset.
+    """
+    key = cache_key(sha256_file(pdf_path), model_id(), chunker="pdf_page_chunks",
+                    chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+    cached = upload_cache.get(key)
+    if cached is not None:
+        return cached["documents"], cached["embeddings"].tolist(), cached["metadatas"], True
+
+    # Pages are extracted in the process pool while we embed the chunks that are
+    # already complete, EMBED_BATCH_SIZE at a time
+    chunks, embeddings, page_metas, batch = [], [], [], []
+    for chunk in iter_pdf_chunks(pdf_path):
+        batch.append(chunk["text"])
+        page_metas.append({"page": chunk["page"], "page_end": chunk["page_end"],
+                           "char_offset": chunk["char_offset"]})
+        if len(batch) >= EMBED_BATCH_SIZE:
+            embeddings.extend(encode(batch).tolist())
+            chunks.extend(batch)
+            batch = []
+    if batch:
+        embeddings.extend(encode(batch).tolist())
+        chunks.extend(batch)
+    upload_cache.put(key, chunks, embeddings=embeddings, metadatas=page_metas)
+    return chunks, embeddings, page_metas, False
+
+def load_bm25_index():
+    """Load the lexical index; backfill it from the collection if it predates the index."""
+    path = bm25_index_path(DB_DIR)
+    bm25 = BM25Index.load(path)
+    if len(bm25) == 0 and collection.count() > 0:
+        print("🔤 Building BM25 index from the existing collection...")
+        total = collection.count()
+        for offset in range(0, total, 1000):
+            page = collection.get(limit=1000, offset=offset, include=["documents", "metadatas"])
+            for doc_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                bm25.add(doc_id, doc, (meta or {}).get("source", ""))
+        bm25.save(path)
+    return bm25
+
+def ingest_pdfs(incremental: bool = True):
+    """
+    Index every PDF in DATA_DIR into the academic_materials collection.
+    With incremental=True only new/changed files (by mtime+size, then sha256) are
+    re-ingested; chunks of shrunken or deleted files are removed from the collection.
+    The BM25 index (bm25_index.pkl) is updated alongside the collection.
+    """
+    start_time = time.perf_counter()
+    bm25 = load_bm25_index()
+    manifest = load_manifest(DB_DIR)
+    old_files = manifest["files"]
+    new_files = {}
+    added, updated, unchanged, removed = [], [], [], []
+    stale_chunks = 0
+
+    pdfs = sorted(f for f in os.listdir(DATA_DIR) if f.endswith(".pdf"))
+    for file in pdfs:
+        pdf_path = os.path.join(DATA_DIR, file)
+        stat = os.stat(pdf_path)
+        entry = old_files.get(file)
+
+        if incremental and entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            new_files[file] = entry
+            unchanged.append(file)
+            continue
+
+        digest = sha256_file(pdf_path)
+        if incremental and entry and entry["sha256"] == digest:
+            # touched but identical content: just refresh the stat info
+            new_files[file] = {**entry, "mtime": stat.st_mtime, "size": stat.st_size}
+            unchanged.append(file)
+            continue
 
+        chunks, embeddings, page_metas, from_cache = build_chunks(pdf_path)
+        ids = chunk_ids(file, len(chunks))
+        metadatas = [{"source": file, "chunk_id": i, **page_metas[i]} for i in range(len(chunks))]
+
+        # upsert so a re-run never collides with ids already in the collection
+        collection.upsert(
+            ids=ids,
+            documents=chunks,
+            embeddings=embeddings,
+            metadatas=metadatas
+        )
+        for chunk_id, chunk in zip(ids, chunks):
+            bm25.add(chunk_id, chunk, file)
+
+        # the file shrank: drop the tail chunks that no longer exist
+        old_count = entry["num_chunks"] if entry else 0
+        if old_count > len(chunks):
+            stale_ids = chunk_ids(file, old_count, start=len(chunks))
+            collection.delete(ids=stale_ids)
+            for chunk_id in stale_ids:
+                bm25.remove(chunk_id)
+            stale_chunks += old_count - len(chunks)
+
+        new_files[file] = {"sha256": digest, "mtime": stat.st_mtime, "size": stat.st_size,
+                           "num_chunks": len(chunks)}
+        (updated if entry else added).append(file)
+        note = " (from upload cache)" if from_cache else ""
+        print(f"✅ Ingested {file} with {len(chunks)} chunks{note}.")
+
+        # persist progress so an interrupted run resumes where it stopped
+        if (len(added) + len(updated)) % CHECKPOINT_EVERY == 0:
+            bm25.save(bm25_index_path(DB_DIR))
+            save_manifest(DB_DIR, {"files": {**old_files, **new_files}})
+
+    # files that disappeared from DATA_DIR
+    for file, entry in old_files.items():
+        if file not in new_files:
+            if entry["num_chunks"]:
+                stale_ids = chunk_ids(file, entry["num_chunks"])
+                collection.delete(ids=stale_ids)
+                for chunk_id in stale_ids:
+                    bm25.remove(chunk_id)
+            stale_chunks += entry["num_chunks"]
+            removed.append(file)
+            print(f"🗑️ Removed {file} ({entry['num_chunks']} chunks).")
+
+    bm25.save(bm25_index_path(DB_DIR))
+    save_manifest(DB_DIR, {"files": new_files})
+    # cached answers built on chunks of changed files are stale (their context keys would
+    # no longer match anyway; this frees them now when ingestion runs in the serving process)
+    answer_cache.invalidate_sources(updated + removed)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"📋 Index summary: {len(added)} added, {len(updated)} updated, {len(unchanged)} unchanged, "
+          f"{len(removed)} removed, {stale_chunks} stale chunks deleted in {elapsed:.1f}s.")
+    return {"added": added, "updated": updated, "unchanged": unchanged, "removed": removed,
+            "stale_chunks": stale_chunks}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index PDFs from data/ into the academic_materials collection")
+    parser.add_argument("--full", action="store_true", help="re-ingest every PDF instead of only new/changed ones")
+    args = parser.parse_args()
+    ingest_pdfs(incremental=not args.full)
@@ -0,0 +1,245 @@
+# llm_scheduler.py
+import os
+import json
+import heapq
+import queue
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future
+
+from metrics import registry
+
+# One local model serves everything: at most OLLAMA_MAX_CONCURRENCY requests run at
+# once, interactive ones first. keep_alive is sent with every request so Ollama keeps
+# the model loaded between them.
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Models loaded by warm_up() (e.g. on server startup), comma-separated
+OLLAMA_WARM_MODELS = [m.strip() for m in os.getenv("OLLAMA_WARM_MODELS", "gemma3:1b").split(",") if m.strip()]
+
+# Lower runs first
+INTERACTIVE = 0
+BATCH = 10
+
+_STREAM_END = object()
+
+
+class _Job:
+    __slots__ = ("fn", "future", "key", "priority", "cancelled", "waiters")
+
+    def __init__(self, fn, priority: int, key=None):
+        self.fn = fn
+        self.future = Future()
+        self.key = key
+        self.priority = priority
+        self.cancelled = False
+        self.waiters = 1   # callers sharing a merged chat request
+
+
+class LLMScheduler:
+    """
+    Central queue in front of Ollama, shared by the API and AgenticRAG (sync and async
+    callers). Jobs wait in a priority queue and run on max_concurrency worker threads.
+    Identical non-streamed chat requests that are queued or running at the same time
+    are merged: later callers get the first one's result.
+    """
+
+    def __init__(self, max_concurrency: int = OLLAMA_MAX_CONCURRENCY, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.keep_alive = keep_alive
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._inflight = {}   # coalescing key -> job
+        self._workers = []
+        self._client = None
+        self.running = 0
+        self.completed = 0
+        self.coalesced = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ollama import Client  # reads OLLAMA_HOST when created
+            self._client = Client()
+        return self._client
+
+    def _start_workers(self):
+        # caller holds self._cond
+        while len(self._workers) < self.max_concurrency:
+            t = threading.Thread(target=self._work, name=f"llm-{len(self._workers)}", daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                self.running += 1
+            ran = False
+            try:
+                if not job.cancelled and job.future.set_running_or_notify_cancel():
+                    ran = True
+                    try:
+                        job.future.set_result(job.fn())
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    self.completed += ran
+                    if job.key is not None and self._inflight.get(job.key) is job:
+                        del self._inflight[job.key]
+
+    def _enqueue(self, job: _Job) -> Future:
+        with self._cond:
+            self._start_workers()
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            self._cond.notify()
+        registry.inc("llm_requests_total", help="Requests submitted to the LLM scheduler",
+                     priority="interactive" if job.priority <= INTERACTIVE else "batch")
+        return job.future
+
+    def run(self, fn, priority: int = INTERACTIVE) -> Future:
+        """Run fn() in an LLM slot (for code that calls Ollama itself). Returns a Future."""
+        return self._enqueue(_Job(fn, priority))
+
+    def submit(self, model: str, messages: list, priority: int = INTERACTIVE, **kwargs) -> Future:
+        """Queue a non-streamed chat request; merged with an identical one already in flight."""
+        return self._submit(model, messages, priority, **kwargs)[1]
+
+    def _submit(self, model: str, messages: list, priority: int, **kwargs) -> tuple:
+        """(coalescing key, future) of a queued or merged chat request."""
+        key = json.dumps({"model": model, "messages": messages, **kwargs}, sort_keys=True, default=str)
+        with self._cond:
+            job = self._inflight.get(key)
+            if job is not None:
+                job.waiters += 1
+                self.coalesced += 1
+                registry.inc("llm_coalesced_total", help="Chat requests merged into an identical in-flight one")
+                if priority < job.priority and not job.future.running():
+                    # promote: re-queue with the better priority, the old entry becomes a no-op
+                    job.cancelled = True
+                    promoted = _Job(job.fn, priority, key)
+                    promoted.future = job.future
+                    promoted.waiters = job.waiters
+                    self._inflight[key] = promoted
+                    heapq.heappush(self._heap, (priority, next(self._seq), promoted))
+                    self._cond.notify()
+                return key, job.future
+            job = _Job(lambda: self.client.chat(model=model, messages=messages, stream=False,
+                                                keep_alive=self.keep_alive, **kwargs), priority, key)
+            self._inflight[key] = job
+        return key, self._enqueue(job)
+
+    def _release(self, key: str, future: Future):
+        """A caller stopped waiting: cancel the request only if nobody else is waiting on it."""
+        with self._cond:
+            job = self._inflight.get(key)
+            if job is None or job.future is not future:
+                return
+            job.waiters -= 1
+            if job.waiters <= 0 and not future.running():
+                job.cancelled = True
+                del self._inflight[key]
+                future.cancel()
+
+    def chat(self, model: str, messages: list, priority: int = INTERACTIVE, **kwargs):
+        """Blocking chat through the scheduler."""
+        return self.submit(model, messages, priority, **kwargs).result()
+
+    async def achat(self, model: str, messages: list, priority: int = INTERACTIVE, **kwargs):
+        """
+        Awaitable chat through the scheduler. Cancelling the caller only detaches it: the
+        shared request keeps running for other merged callers (and is dropped from the
+        queue once none are left).
+        """
+        key, future = self._submit(model, messages, priority, **kwargs)
+        try:
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            self._release(key, future)
+            raise
+
+    def _stream_job(self, model: str, messages: list, priority: int, sink, **kwargs) -> _Job:
+        """A job that holds one slot for the whole generation and hands tokens to sink()."""
+        def generate():
+            try:
+                for part in self.client.chat(model=model, messages=messages, stream=True,
+                                             keep_alive=self.keep_alive, **kwargs):
+                    if job.cancelled:
+                        break  # consumer went away: free the slot
+                    token = part["message"]["content"]
+                    if token:
+                        sink(token)
+                sink(_STREAM_END)
+            except BaseException as e:
+                sink(e)
+
+        job = _Job(generate, priority)
+        return job
+
+    def stream(self, model: str, messages: list, priority: int = INTERACTIVE, **kwargs):
+        """Blocking generator of content tokens; streams are never merged."""
+        tokens = queue.Queue()
+        job = self._stream_job(model, messages, priority, tokens.put, **kwargs)
+        self._enqueue(job)
+        try:
+            while True:
+                item = tokens.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            job.cancelled = True
+
+    async def astream(self, model: str, messages: list, priority: int = INTERACTIVE, **kwargs):
+        """Async generator of content tokens."""
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        job = self._stream_job(model, messages, priority,
+                               lambda item: loop.call_soon_threadsafe(tokens.put_nowait, item), **kwargs)
+        self._enqueue(job)
+        try:
+            while True:
+                item = await tokens.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            job.cancelled = True
+
+    def warm_up(self, models: list | None = None):
+        """Load models into Ollama ahead of the first request (an empty generate just loads)."""
+        for model in models or OLLAMA_WARM_MODELS:
+            try:
+                self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+                print(f"🔥 Warmed up {model} (keep_alive={self.keep_alive})")
+            except Exception as e:
+                print(f"⚠️ Could not warm up {model}: {e}")
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"queued": len(self._heap), "running": self.running, "completed": self.completed,
+                    "coalesced": self.coalesced, "max_concurrency": self.max_concurrency}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """The process-wide scheduler."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
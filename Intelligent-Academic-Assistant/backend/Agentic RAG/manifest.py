@@ -0,0 +1,39 @@
+# manifest.py
+import os
+import json
+
+# Lives next to the Chroma files; records what ingest_pdfs has indexed:
+# {"files": {"notes.pdf": {"sha256": ..., "mtime": ..., "size": ..., "num_chunks": ...}}}
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+def manifest_path(db_dir: str) -> str:
+    return os.path.join(db_dir, MANIFEST_NAME)
+
+
+def load_manifest(db_dir: str) -> dict:
+    path = manifest_path(db_dir)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get("files"), dict):
+                return manifest
+        except (OSError, ValueError):
+            print(f"⚠️ Ignoring unreadable manifest {path}, a full re-index will run.")
+    return {"files": {}}
+
+
+def save_manifest(db_dir: str, manifest: dict):
+    """Write atomically so an interrupted run never leaves a truncated manifest."""
+    os.makedirs(db_dir, exist_ok=True)
+    path = manifest_path(db_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def chunk_ids(file: str, num_chunks: int, start: int = 0) -> list:
+    """Chunk ids used in the collection for a source file."""
+    return [f"{file}_{i}" for i in range(start, num_chunks)]
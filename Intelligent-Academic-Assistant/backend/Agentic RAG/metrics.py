@@ -0,0 +1,138 @@
+# metrics.py
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+# Latency buckets (seconds) for stage histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Size buckets for counts like retrieved chunks / prompt characters
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """
+    Minimal in-process metrics registry (counters, gauges, histograms) rendered in
+    the Prometheus text format. Metrics are keyed by name + sorted label pairs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._gauges = {}      # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> {"buckets", "counts", "sum", "count"}
+        self._help = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, help: str = "", **labels):
+        with self._lock:
+            self._help.setdefault(name, ("gauge", help))
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS, help: str = "", **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = {"buckets": tuple(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+                self._histograms[key] = hist
+            idx = bisect.bisect_left(hist["buckets"], value)
+            if idx < len(hist["counts"]):
+                hist["counts"][idx] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    @staticmethod
+    def _fmt_labels(labels, extra=None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._help):
+                kind, help_text = self._help[name]
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (n, labels), value in sorted(self._counters.items()):
+                        if n == name:
+                            lines.append(f"{name}{self._fmt_labels(labels)} {value}")
+                elif kind == "gauge":
+                    for (n, labels), value in sorted(self._gauges.items()):
+                        if n == name:
+                            lines.append(f"{name}{self._fmt_labels(labels)} {value}")
+                else:
+                    for (n, labels), hist in sorted(self._histograms.items()):
+                        if n != name:
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(hist["buckets"], hist["counts"]):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{self._fmt_labels(labels, ('le', bound))} {cumulative}")
+                        lines.append(f"{name}_bucket{self._fmt_labels(labels, ('le', '+Inf'))} {hist['count']}")
+                        lines.append(f"{name}_sum{self._fmt_labels(labels)} {hist['sum']}")
+                        lines.append(f"{name}_count{self._fmt_labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Per-request timing breakdown: {stage: milliseconds}, set by start_trace()
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextlib.contextmanager
+def start_trace():
+    """Collect the stage timings of everything run inside this block (same context)."""
+    trace = {}
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> dict | None:
+    return _current_trace.get()
+
+
+def record_stage(pipeline: str, name: str, seconds: float):
+    registry.observe("rag_stage_duration_seconds", seconds,
+                     help="Time spent in each pipeline stage", pipeline=pipeline, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace[name] = round(trace.get(name, 0.0) + seconds * 1000, 2)
+
+
+@contextlib.contextmanager
+def stage(pipeline: str, name: str):
+    """Time a block as one stage of a pipeline (histogram + current trace)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, name, time.perf_counter() - start)
+
+
+def observe_size(name: str, value: float, help: str = "", **labels):
+    registry.observe(name, value, buckets=SIZE_BUCKETS, help=help, **labels)
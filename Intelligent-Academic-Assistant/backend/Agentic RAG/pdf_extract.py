@@ -0,0 +1,146 @@
+# pdf_extract.py
+import os
+import re
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Parallel page extraction. Pages are split into ranges of PAGES_PER_TASK and
+# parsed in a shared process pool; small PDFs are parsed inline.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Workers are spawned, never forked: the pool is also started from the multithreaded API
+# server, and a forked child can inherit locks held by other threads and deadlock
+PDF_EXTRACT_START_METHOD = os.getenv("PDF_EXTRACT_START_METHOD", "spawn")
+
+WORD_RE = re.compile(r"\S+")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Process pool shared by the CLI ingestion and the upload endpoints."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS,
+                                            mp_context=multiprocessing.get_context(PDF_EXTRACT_START_METHOD))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def page_count(pdf_path: str, engine: str = "pymupdf") -> int:
+    if engine == "pymupdf":
+        import fitz
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    from PyPDF2 import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+def extract_page_range(pdf_path: str, engine: str, start: int, end: int) -> list:
+    """Extract pages [start, end) in the current process. Runs inside pool workers."""
+    if engine == "pymupdf":
+        import fitz
+        with fitz.open(pdf_path) as doc:
+            return [doc[i].get_text("text") for i in range(start, end)]
+    from PyPDF2 import PdfReader
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_page_texts(pdf_path: str, engine: str = "pymupdf", workers: int | None = None):
+    """
+    Yield page texts in page order as soon as each range is extracted.
+    engine is 'pymupdf' (fitz) or 'pypdf2'. Only a bounded number of ranges are
+    in flight, so memory stays proportional to workers, not to the book.
+    """
+    workers = workers or PDF_EXTRACT_WORKERS
+    n_pages = page_count(pdf_path, engine)
+    ranges = [(s, min(s + PAGES_PER_TASK, n_pages)) for s in range(0, n_pages, PAGES_PER_TASK)]
+
+    if workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield from extract_page_range(pdf_path, engine, start, end)
+        return
+
+    pool = get_pool()
+    max_in_flight = workers * 2
+    remaining = iter(ranges)
+    pending = deque()
+    for start, end in remaining:
+        pending.append(pool.submit(extract_page_range, pdf_path, engine, start, end))
+        if len(pending) >= max_in_flight:
+            break
+    try:
+        while pending:
+            future = pending.popleft()
+            # keep the pool busy while the caller consumes this range
+            nxt = next(remaining, None)
+            if nxt is not None:
+                pending.append(pool.submit(extract_page_range, pdf_path, engine, *nxt))
+            yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_text(pdf_path: str, engine: str = "pymupdf", workers: int | None = None) -> str:
+    """Whole-document text, merged with a single join instead of repeated +=."""
+    return "".join(iter_page_texts(pdf_path, engine=engine, workers=workers))
+
+
+def iter_page_chunks(pages, chunk_size: int = 500, overlap: int = 50):
+    """
+    Sliding word window over a stream of page texts (e.g. from iter_page_texts).
+    Yields {'text', 'page', 'page_end', 'char_offset'} per chunk: pages are 1-based and
+    char_offset is where the chunk starts within its first page. Only the pages the
+    current window touches are held in memory, and chunk text is sliced straight from
+    them, so overlapping words are never re-joined.
+    """
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    page_texts = {}   # page number -> text, only for pages inside the window
+    window = []       # (page, start, end) of each word in the window
+
+    def emit(n_words):
+        first_page, start, _ = window[0]
+        last_page, _, end = window[n_words - 1]
+        if first_page == last_page:
+            text = page_texts[first_page][start:end]
+        else:
+            text = "".join([page_texts[first_page][start:]]
+                           + [page_texts[p] for p in range(first_page + 1, last_page)]
+                           + [page_texts[last_page][:end]])
+        return {"text": text, "page": first_page, "page_end": last_page, "char_offset": start}
+
+    def advance():
+        del window[:step]
+        oldest = window[0][0] if window else None
+        for p in [p for p in page_texts if oldest is None or p < oldest]:
+            del page_texts[p]
+
+    for page_no, text in enumerate(pages, start=1):
+        page_texts[page_no] = text
+        window.extend((page_no, m.start(), m.end()) for m in WORD_RE.finditer(text))
+        if not window:
+            page_texts.pop(page_no, None)  # blank page, nothing in the window refers to it
+        while len(window) >= chunk_size:
+            yield emit(chunk_size)
+            advance()
+    # tail windows shorter than chunk_size
+    while window:
+        yield emit(len(window))
+        advance()
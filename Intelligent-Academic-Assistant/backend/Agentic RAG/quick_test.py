@@ -1,10 +1,13 @@
 # quick_test.py
 from agentic_rag import AgenticRAG
-agent = AgenticRAG()
+from artifact_log import ARTIFACT_LOG_DIR
+agent = AgenticRAG(web_fallback="ask")  # interactive: confirm before searching the web
 q = input("Enter your academic question: ")
 resp = agent.handle_query(q)
 if resp['action'] == 'clarify':
     print("Clarify:", resp['prompt'])
 else:
     print("Answer:\n", resp['answer'])
-    print("Saved file:", resp['file'])
+    # answers are records in the gzip artifact log, not files: read them back with
+    # artifact_log.read_records(kind="answer") and match on 'name'
+    print("Logged as:", resp['file'], f"(artifact log in {ARTIFACT_LOG_DIR}/, see artifact_log.read_records)")
@@ -1,52 +1,309 @@
 # retrieval.py
 import os
-from sentence_transformers import SentenceTransformer
+import time
+import hashlib
+import threading
+import numpy as np
 import chromadb
+from embedder import encode, score_pairs
+from metrics import record_stage, registry
+from artifact_log import artifact_log
+from cache_utils import LRUCache, normalize_query
+from manifest import manifest_path, load_manifest
+from bm25_index import BM25Index, bm25_index_path, reciprocal_rank_fusion
 
 DB_DIR = "agentic_rag_db"
-RETRIEVED_DIR = "retrieved"
 
-# Initialize db & embedder (same model used for ingestion)
+# Initialize db (the embedder is shared with ingestion and loaded on first query)
 client = chromadb.PersistentClient(path=DB_DIR)
 collection = client.get_or_create_collection("academic_materials")
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
 
-def query_collection(query: str, top_k: int = 3, source_filter: list | None = None):
+# Caches: normalized query -> embedding, and (embedding, top_k, filter, collection version) -> result ids
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+embedding_cache = LRUCache(max_entries=QUERY_EMBED_CACHE_SIZE)
+result_cache = LRUCache(max_entries=RESULT_CACHE_SIZE)
+
+# When a source filter can't be pushed into the query, fetch this many times top_k
+OVERFETCH_FACTOR = int(os.getenv("OVERFETCH_FACTOR", "4"))
+
+# 'hybrid' fuses vector + BM25 rankings (falls back to 'vector' if there is no BM25 index yet);
+# each ranker contributes top_k * HYBRID_CANDIDATES candidates to the fusion
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+
+# Optional re-ranking: fetch top_k * RERANK_CANDIDATES chunks, score them with a CPU
+# cross-encoder (embedder.RERANK_MODEL) and keep the best min(top_k, RERANK_TOP_N).
+# Scores are cached per (query, chunk text).
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "4"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+rerank_score_cache = LRUCache(max_entries=int(os.getenv("RERANK_CACHE_SIZE", "8192")))
+_rerank_totals = {"queries": 0, "pairs_scored": 0, "seconds": 0.0, "tokens_saved": 0}
+_rerank_lock = threading.Lock()
+
+def embed_queries(queries: list) -> list:
+    """Embeddings for many queries: cached ones are reused, the rest are encoded in one batch."""
+    keys = [normalize_query(q) for q in queries]
+    found = {key: embedding_cache.get(key) for key in dict.fromkeys(keys)}
+    missing = [key for key, embedding in found.items() if embedding is None]
+    if missing:
+        for key, embedding in zip(missing, encode(missing)):
+            embedding_cache.put(key, embedding)
+            found[key] = embedding
+    return [found[key] for key in keys]
+
+def embed_query(query: str) -> np.ndarray:
+    """Query embedding, served from the cache for repeated questions."""
+    return embed_queries([query])[0]
+
+def collection_version():
+    """Changes whenever ingest_pdfs adds/removes chunks, which invalidates cached results."""
+    try:
+        manifest_mtime = os.path.getmtime(manifest_path(DB_DIR))
+    except OSError:
+        manifest_mtime = 0.0
+    return collection.count(), manifest_mtime
+
+def cache_stats() -> dict:
+    return {"query_embeddings": embedding_cache.stats(), "results": result_cache.stats(),
+            "rerank_scores": rerank_score_cache.stats()}
+
+def clear_caches():
+    embedding_cache.clear()
+    result_cache.clear()
+    rerank_score_cache.clear()
+
+def rerank_stats() -> dict:
+    """Totals of the re-ranking stage: its cost (seconds) and what it saved (prompt tokens)."""
+    with _rerank_lock:
+        totals = dict(_rerank_totals)
+    totals["seconds"] = round(totals["seconds"], 4)
+    totals["mean_ms"] = round(totals["seconds"] * 1000 / totals["queries"], 2) if totals["queries"] else 0.0
+    return totals
+
+def estimate_tokens(text: str) -> int:
+    # same ~4 chars/token estimate context_packing falls back to
+    return len(text) // 4 + 1
+
+def rerank_results(queries: list, results: list, keep: int, baseline_k: int) -> list:
     """
-    Returns the raw chroma query results (dict containing documents and metadatas).
-    If source_filter is provided (list of substrings), results are filtered by metadata['source'].
+    Re-order each query's candidates by cross-encoder score and keep the best `keep`.
+    All uncached (query, chunk) pairs of the batch are scored in one predict() call.
+    tokens_saved counts the chunk text no longer sent compared to the first-stage top baseline_k.
     """
-    query_embedding = embedder.encode([query]).tolist()[0]
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_k,
-        include=["documents", "metadatas"]
-    )
+    start = time.perf_counter()
+    keys, known, pending = [], {}, {}
+    for query, result in zip(queries, results):
+        qkey = normalize_query(query)
+        row = []
+        for doc in result["documents"][0]:
+            key = (qkey, hashlib.sha1(doc.encode("utf-8")).hexdigest())
+            if key not in known and key not in pending:
+                score = rerank_score_cache.get(key)
+                if score is None:
+                    pending[key] = (query, doc)
+                else:
+                    known[key] = score
+            row.append(key)
+        keys.append(row)
+    for key, score in zip(pending, score_pairs(list(pending.values()))):
+        rerank_score_cache.put(key, score)
+        known[key] = score
 
-    docs = results.get("documents", [[]])[0]
-    metadatas = results.get("metadatas", [[]])[0]
-
-    # Optional simple client-side filtering by source filename substrings
-    if source_filter:
-        filtered_docs = []
-        filtered_metas = []
-        for d, m in zip(docs, metadatas):
-            src = m.get("source", "") if isinstance(m, dict) else ""
-            if any(s.lower() in src.lower() for s in source_filter):
-                filtered_docs.append(d)
-                filtered_metas.append(m)
-        return {"documents": [filtered_docs], "metadatas": [filtered_metas]}
+    reranked, saved = [], 0
+    for row, result in zip(keys, results):
+        ids, docs, metas = result["ids"][0], result["documents"][0], result["metadatas"][0]
+        scores = [known[key] for key in row]
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:keep]
+        baseline = sum(estimate_tokens(d) for d in docs[:baseline_k])
+        saved += max(0, baseline - sum(estimate_tokens(docs[i]) for i in order))
+        reranked.append({"ids": [[ids[i] for i in order]], "documents": [[docs[i] for i in order]],
+                         "metadatas": [[metas[i] for i in order]],
+                         "scores": [[scores[i] for i in order]]})
+
+    seconds = time.perf_counter() - start
+    record_stage("retrieval", "rerank", seconds)
+    registry.inc("rag_rerank_pairs_scored_total", len(pending), help="Cross-encoder pairs scored (cache misses)")
+    registry.inc("rag_rerank_tokens_saved_total", saved, help="Estimated prompt tokens dropped by re-ranking")
+    with _rerank_lock:
+        _rerank_totals["queries"] += len(queries)
+        _rerank_totals["pairs_scored"] += len(pending)
+        _rerank_totals["seconds"] += seconds
+        _rerank_totals["tokens_saved"] += saved
+    return reranked
+
+def source_matches(source: str, source_filter: list) -> bool:
+    src = source.lower()
+    return any(s.lower() in src for s in source_filter)
+
+_source_index = {"mtime": None, "sources": None}
+
+def load_source_index() -> dict | None:
+    """
+    {source filename: chunk count} for everything ingest_pdfs has indexed, read from
+    the ingest manifest (reloaded only when it changes). None if there is no manifest.
+    """
+    path = manifest_path(DB_DIR)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _source_index["mtime"] != mtime:
+        files = load_manifest(DB_DIR)["files"]
+        _source_index["sources"] = {f: e.get("num_chunks", 0) for f, e in files.items()} or None
+        _source_index["mtime"] = mtime
+    return _source_index["sources"]
+
+def plan_source_filter(source_filter: list | None, top_k: int):
+    """
+    Turn substring source filters into (where, n_results) for collection.query.
+    With the source index the substrings are resolved to exact filenames and pushed
+    down as a `$in` clause, so Chroma returns k matching hits directly. Without it we
+    over-fetch by OVERFETCH_FACTOR and filter on the client.
+    """
+    if not source_filter:
+        return None, top_k
+
+    sources = load_source_index()
+    if sources is not None:
+        matching = [src for src in sources if source_matches(src, source_filter)]
+        available = sum(sources[src] for src in matching)
+        if not matching or available == 0:
+            return None, 0
+        return {"source": {"$in": matching}}, min(top_k, available)
+
+    return None, max(1, min(collection.count(), top_k * OVERFETCH_FACTOR))
 
+_bm25 = {"mtime": None, "index": None}
+
+def load_bm25() -> BM25Index | None:
+    """The BM25 index written by ingest_pdfs, reloaded whenever the file changes."""
+    path = bm25_index_path(DB_DIR)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _bm25["mtime"] != mtime:
+        _bm25["index"] = BM25Index.load(path)
+        _bm25["mtime"] = mtime
+    return _bm25["index"] if len(_bm25["index"]) else None
+
+def fetch_many(id_lists: list) -> list:
+    """Fetch documents + metadatas for several ranked id lists in one get(), keeping each order."""
+    wanted = list(dict.fromkeys(i for ids in id_lists for i in ids))
+    by_id = {}
+    if wanted:
+        got = collection.get(ids=wanted, include=["documents", "metadatas"])
+        by_id = {i: (d, m) for i, d, m in zip(got["ids"], got["documents"], got["metadatas"])}
+    results = []
+    for ids in id_lists:
+        ids = [i for i in ids if i in by_id]
+        results.append({
+            "ids": [ids],
+            "documents": [[by_id[i][0] for i in ids]],
+            "metadatas": [[by_id[i][1] for i in ids]],
+        })
     return results
 
-def retrieve_and_save(query: str, top_k: int = 3, source_filter: list | None = None):
+def fetch_by_ids(ids: list):
+    """Fetch documents + metadatas for cached result ids, keeping the ranking order."""
+    return fetch_many([ids])[0]
+
+def query_collection(query: str, top_k: int = 3, source_filter: list | None = None, mode: str | None = None,
+                     rerank: bool | None = None):
     """
-    Queries chroma, saves top_k chunks to RETRIEVED_DIR and returns a list of dicts:
-    [{'file': filename, 'text': chunk_text, 'meta': metadata}, ...]
+    Returns the raw chroma query results (dict containing documents and metadatas).
+    If source_filter is provided (list of substrings), only chunks whose metadata['source']
+    contains one of them are returned; the filter is evaluated inside the index when possible.
+    mode is 'vector' or 'hybrid' (default RETRIEVAL_MODE): hybrid fuses the vector ranking
+    with the BM25 ranking, which catches exact terms like course codes and theorem names.
+    Repeated queries reuse the cached embedding and, until the collection changes, the cached result ids.
+    rerank (default RERANK) over-fetches and keeps the cross-encoder's best min(top_k, RERANK_TOP_N).
     """
-    os.makedirs(RETRIEVED_DIR, exist_ok=True)
-    results = query_collection(query, top_k=top_k, source_filter=source_filter)
+    return query_collection_batch([query], top_k=top_k, source_filter=source_filter, mode=mode, rerank=rerank)[0]
+
+def query_collection_batch(queries: list, top_k: int = 3, source_filter: list | None = None,
+                           mode: str | None = None, rerank: bool | None = None) -> list:
+    """
+    query_collection for many queries sharing top_k / source_filter: one batched embedding
+    pass for the uncached queries, one collection.query for all of them and one get() for
+    results that come from the cache or the hybrid fusion. Results are in query order.
+    """
+    rerank = RERANK if rerank is None else rerank
+    if rerank:
+        candidates = _query_batch(queries, top_k * RERANK_CANDIDATES, source_filter, mode)
+        return rerank_results(queries, candidates, keep=min(top_k, RERANK_TOP_N), baseline_k=top_k)
+    return _query_batch(queries, top_k, source_filter, mode)
+
+def _query_batch(queries: list, top_k: int, source_filter: list | None, mode: str | None) -> list:
+    mode = mode or RETRIEVAL_MODE
+    bm25 = load_bm25() if mode == "hybrid" else None
+    if bm25 is None:
+        mode = "vector"
+
+    embeddings = embed_queries(queries)
+    version = collection_version()
+    filter_key = tuple(source_filter) if source_filter else None
+    cache_keys = [(hashlib.sha1(e.tobytes()).hexdigest(), top_k, filter_key, mode, version) for e in embeddings]
+    final_ids = [result_cache.get(key) for key in cache_keys]
+    results = [None] * len(queries)
+
+    pending = [i for i, ids in enumerate(final_ids) if ids is None]
+    # hybrid mode: each ranker contributes a deeper candidate list to the fusion
+    candidates = top_k * HYBRID_CANDIDATES if mode == "hybrid" else top_k
+    where, n_results = plan_source_filter(source_filter, candidates) if pending else (None, 0)
+    if pending and n_results == 0:
+        # the source index says no document matches the filter: nothing to query
+        for i in pending:
+            final_ids[i] = []
+            result_cache.put(cache_keys[i], [])
+    elif pending:
+        raw = collection.query(
+            query_embeddings=[embeddings[i].tolist() for i in pending],
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas"]
+        )
+        for j, i in enumerate(pending):
+            ids = raw.get("ids", [[]])[j]
+            docs = raw.get("documents", [[]])[j]
+            metadatas = raw.get("metadatas", [[]])[j]
 
+            # No pushdown possible: filter the over-fetched candidates on the client
+            if source_filter and where is None:
+                filtered_ids = []
+                filtered_docs = []
+                filtered_metas = []
+                for cid, d, m in zip(ids, docs, metadatas):
+                    src = m.get("source", "") if isinstance(m, dict) else ""
+                    if source_matches(src, source_filter):
+                        filtered_ids.append(cid)
+                        filtered_docs.append(d)
+                        filtered_metas.append(m)
+                ids, docs, metadatas = filtered_ids, filtered_docs, filtered_metas
+
+            if mode == "hybrid":
+                source_pred = (lambda src: source_matches(src, source_filter)) if source_filter else None
+                lexical_ids = [doc_id for doc_id, _ in bm25.search(queries[i], top_k=candidates, source_pred=source_pred)]
+                final_ids[i] = reciprocal_rank_fusion([list(ids), lexical_ids])[:top_k]
+            else:
+                ids, docs, metadatas = ids[:top_k], docs[:top_k], metadatas[:top_k]
+                final_ids[i] = list(ids)
+                results[i] = {"ids": [ids], "documents": [docs], "metadatas": [metadatas]}
+            result_cache.put(cache_keys[i], final_ids[i])
+
+    # cached and fused results only have ids: fetch them all at once
+    to_fetch = [i for i, r in enumerate(results) if r is None]
+    for i, fetched in zip(to_fetch, fetch_many([final_ids[i] for i in to_fetch])):
+        results[i] = fetched
+    return results
+
+def save_retrieved(results: dict, query: str | None = None) -> list:
+    """
+    Logs the chunks of one query result (background artifact log, see artifact_log.py)
+    and returns a list of dicts: [{'file': filename, 'text': chunk_text, 'meta': metadata}, ...]
+    """
     docs = results.get("documents", [[]])[0]
     metas = results.get("metadatas", [[]])[0]
 
@@ -55,8 +312,14 @@ def retrieve_and_save(query: str, top_k: int = 3, source_filter: list | None = N
         source = m.get("source", "unknown_source")
         chunk_id = m.get("chunk_id", "0")
         filename = f"{source}_chunk{chunk_id}.txt"
-        out_path = os.path.join(RETRIEVED_DIR, filename)
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(d)
         retrieved.append({"file": filename, "text": d, "meta": m})
+    if retrieved:
+        artifact_log.log("retrieved", {"query": query, "chunks": retrieved})
     return retrieved
+
+def retrieve_and_save(query: str, top_k: int = 3, source_filter: list | None = None):
+    """
+    Queries chroma, logs the top_k chunks and returns a list of dicts:
+    [{'file': filename, 'text': chunk_text, 'meta': metadata}, ...]
+    """
+    return save_retrieved(query_collection(query, top_k=top_k, source_filter=source_filter), query)
@@ -0,0 +1,120 @@
+# upload_cache.py
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import numpy as np
+
+# Where built chunk/embedding sets are kept, and how big the cache may grow
+CACHE_DIR = os.getenv("UPLOAD_CACHE_DIR", "upload_cache")
+CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: str, block_size: int = 1 << 20) -> str:
+    """Hash a file without loading it into memory."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(content_hash: str, embed_model: str, **chunk_params) -> str:
+    """
+    Key for a built chunk set: PDF content + chunking parameters + embedding model.
+    Changing any of them (e.g. a different overlap) produces a different entry.
+    """
+    params = json.dumps(chunk_params, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}|{embed_model}|{params}".encode("utf-8")).hexdigest()
+
+
+class UploadCache:
+    """
+    Persistent, content-addressed cache of chunk/embedding sets.
+    Layout: <root>/<key>/chunks.json (+ embeddings.npy). Entries are evicted
+    least-recently-used first once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> dict | None:
+        """Return {'ids', 'documents', 'metadatas', 'embeddings'} or None on a miss."""
+        entry_dir = self._entry_dir(key)
+        chunks_path = os.path.join(entry_dir, "chunks.json")
+        if not os.path.exists(chunks_path):
+            return None
+        try:
+            with open(chunks_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            emb_path = os.path.join(entry_dir, "embeddings.npy")
+            entry["embeddings"] = np.load(emb_path) if os.path.exists(emb_path) else None
+        except (OSError, ValueError):
+            # half-written or corrupt entry: drop it and rebuild
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # bump recency for LRU eviction
+        now = time.time()
+        try:
+            os.utime(entry_dir, (now, now))
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, documents: list, embeddings=None, metadatas: list | None = None,
+            ids: list | None = None):
+        """Store a chunk set. Written to a temp dir first so readers never see a partial entry."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}_{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            with open(os.path.join(tmp_dir, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f)
+            if embeddings is not None:
+                np.save(os.path.join(tmp_dir, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32))
+            with self._lock:
+                if os.path.exists(entry_dir):
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_dir, entry_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def _entry_size(self, entry_dir: str) -> int:
+        total = 0
+        for name in os.listdir(entry_dir):
+            try:
+                total += os.path.getsize(os.path.join(entry_dir, name))
+            except OSError:
+                pass
+        return total
+
+    def evict(self):
+        """Remove least-recently-used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not os.path.isdir(path) or ".tmp" in name:
+                    continue
+                entries.append((os.path.getmtime(path), self._entry_size(path), path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
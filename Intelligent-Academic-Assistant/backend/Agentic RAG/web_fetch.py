@@ -1,17 +1,128 @@
 # web_fetch.py
-from duckduckgo_search import DDGS
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from cache_utils import normalize_query
 
-def fetch_web_data(query: str, top_k: int = 3) -> list:
+# Search backend: 'duckduckgo' (default) or 'http', a JSON endpoint such as the local
+# stand-in in fake_ollama.py (GET <WEB_SEARCH_URL>?q=...&n=... -> {"results": [{"body": ...}]}).
+# Others can be added with register_backend().
+WEB_SEARCH_BACKEND = os.getenv("WEB_SEARCH_BACKEND", "duckduckgo")
+WEB_SEARCH_URL = os.getenv("WEB_SEARCH_URL", "http://127.0.0.1:11435/search")
+WEB_FETCH_TIMEOUT = float(os.getenv("WEB_FETCH_TIMEOUT", "8"))  # seconds
+
+# Results are cached on disk by normalized query. Failed / empty searches are cached
+# for a shorter time so repeated misses on a topic return at once instead of re-searching.
+WEB_CACHE_DIR = os.getenv("WEB_CACHE_DIR", "web_cache")
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL_HOURS", "24")) * 3600
+WEB_CACHE_NEGATIVE_TTL = float(os.getenv("WEB_CACHE_NEGATIVE_TTL_MIN", "30")) * 60
+
+_cache_lock = threading.Lock()
+# Searches run here; a search that times out keeps its thread until it returns, but
+# callers stop waiting for it (and asyncio.run doesn't wait for this pool on exit)
+_search_pool = ThreadPoolExecutor(max_workers=int(os.getenv("WEB_FETCH_WORKERS", "4")),
+                                  thread_name_prefix="web-fetch")
+
+
+def _bodies(results, top_k: int) -> list:
+    chunks = []
+    for r in results or []:
+        body = (r.get("body") or "").strip()
+        if body:
+            chunks.append(body)
+        if len(chunks) >= top_k:
+            break
+    return chunks
+
+
+def _duckduckgo_search(query: str, top_k: int, timeout: float) -> list:
+    from duckduckgo_search import DDGS
+    with DDGS(timeout=int(timeout)) as ddgs:
+        return _bodies(ddgs.text(query, max_results=top_k), top_k)
+
+
+def _http_search(query: str, top_k: int, timeout: float) -> list:
+    url = f"{WEB_SEARCH_URL}?{urllib.parse.urlencode({'q': query, 'n': top_k})}"
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        data = json.loads(resp.read().decode("utf-8"))
+    return _bodies(data.get("results", []) if isinstance(data, dict) else data, top_k)
+
+
+# name -> blocking search(query, top_k, timeout) -> list of text chunks
+BACKENDS = {"duckduckgo": _duckduckgo_search, "http": _http_search}
+
+
+def register_backend(name: str, search_fn):
+    """Add a search backend: search_fn(query, top_k, timeout) -> list of text chunks."""
+    BACKENDS[name] = search_fn
+
+
+def _cache_path(key: str) -> str:
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(WEB_CACHE_DIR, f"{digest}.json")
+
+
+def cache_get(query: str, top_k: int) -> list | None:
+    """Cached chunks for this query if still fresh and deep enough, else None."""
+    key = normalize_query(query)
+    try:
+        with open(_cache_path(key), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    ttl = WEB_CACHE_TTL if entry["chunks"] else WEB_CACHE_NEGATIVE_TTL
+    if time.time() - entry["ts"] > ttl:
+        return None
+    if entry["chunks"] and len(entry["chunks"]) < top_k and entry["top_k"] < top_k:
+        return None  # an earlier, shallower search: fetch more
+    return entry["chunks"][:top_k]
+
+
+def cache_put(query: str, top_k: int, chunks: list):
+    key = normalize_query(query)
+    os.makedirs(WEB_CACHE_DIR, exist_ok=True)
+    path = _cache_path(key)
+    tmp = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"query": key, "top_k": top_k, "ts": time.time(), "chunks": chunks}, f)
+    with _cache_lock:
+        os.replace(tmp, path)
+
+
+async def fetch_web_data_async(query: str, top_k: int = 3, backend: str | None = None,
+                               timeout: float = WEB_FETCH_TIMEOUT) -> list:
     """
-    Fetch data from web using DuckDuckGo search and return top_k text chunks.
+    Fetch top_k text chunks from the web for query, through the on-disk cache.
+    The search runs in a worker thread and is abandoned after timeout seconds;
+    errors and timeouts return [] (and are cached briefly as a miss).
     """
-    chunks = []
-    with DDGS() as ddgs:
-        results = ddgs.text(query, max_results=top_k)
-        for r in results:
-            body = r.get("body", "").strip()
-            if body:
-                chunks.append(body)
-            if len(chunks) >= top_k:
-                break
+    cached = cache_get(query, top_k)
+    if cached is not None:
+        return cached
+    search = BACKENDS[backend or WEB_SEARCH_BACKEND]
+    loop = asyncio.get_running_loop()
+    try:
+        chunks = await asyncio.wait_for(loop.run_in_executor(_search_pool, search, query, top_k, timeout), timeout)
+    except Exception as e:
+        print(f"⚠️ Web search failed ({type(e).__name__}: {e})")
+        chunks = []
+    cache_put(query, top_k, chunks)
     return chunks
+
+
+def fetch_web_data(query: str, top_k: int = 3, backend: str | None = None,
+                   timeout: float = WEB_FETCH_TIMEOUT) -> list:
+    """
+    Fetch data from the web (see fetch_web_data_async) and return top_k text chunks.
+    Blocking wrapper for synchronous callers; must not be called from an event loop thread.
+    """
+    cached = cache_get(query, top_k)
+    if cached is not None:
+        return cached
+    return asyncio.run(fetch_web_data_async(query, top_k, backend=backend, timeout=timeout))
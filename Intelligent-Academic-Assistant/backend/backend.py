@@ -1,24 +1,46 @@
 import os
+import sys
+import time
 import shutil
+import asyncio
+import functools
+import contextvars
 import uvicorn
 import json
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-import chromadb
+from chromadb.utils import embedding_functions
 from ollama import Client
 
 
 # Import helpers
-from extract_and_store import extract_text_from_pdf, chunk_text, store_in_chroma
+from extract_and_store import extract_text_from_pdf, chunk_text
 from summarize_pdf import summarize
 
+# Shared helpers from the Agentic RAG package (flat modules, imported by name)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Agentic RAG"))
+from upload_cache import UploadCache, cache_key, sha256_file
+from rag_ingest import add_chunks_batched, add_cached_chunks, snapshot_collection, RAG_ADD_BATCH_SIZE
+from chroma_pool import ChromaPool
+from history_store import HistoryStore, HISTORY_MAX_TURNS, HISTORY_MAX_TOKENS
+from session_store import SessionStore, RAG_SESSION_TTL, RAG_REAPER_INTERVAL
+from mapreduce_summary import SummaryCache, mapreduce_summarize
+from upload_stream import UploadTooLarge, copy_upload, content_length_too_large, UPLOAD_MAX_BYTES
+from context_packing import pack_context, warm_up_tokenizers, CONTEXT_TOKEN_BUDGET
+from metrics import registry, stage, start_trace, observe_size
+from llm_scheduler import get_scheduler, INTERACTIVE, BATCH, OLLAMA_WARM_MODELS
+from answer_cache import answer_cache, context_key
+
 # Config
 UPLOAD_DIR = os.path.abspath("./uploads")
 DB_DIR = os.path.abspath("./chroma_db")   # always reused but cleared per upload
 COLLECTION_NAME = "pdf_chunks"
+# Chroma's default embedding function (ONNX all-MiniLM-L6-v2); part of the upload cache key
+CHROMA_EMBED_MODEL = "chroma-default:all-MiniLM-L6-v2"
 
 # Ensure dirs
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -28,6 +50,98 @@ os.makedirs(DB_DIR, exist_ok=True)
 app = FastAPI()
 ollama_client = Client()
 
+# Cache of built chunk/embedding sets, keyed by PDF content + chunking params + model
+upload_cache = UploadCache()
+
+# Open Chroma clients/collections, reused across requests (one per DB path / session).
+# DB_DIR is pinned: summarize() opens its own client on it, sharing chromadb's system.
+chroma_pool = ChromaPool(pinned=[DB_DIR])
+
+# Blocking work (file I/O, PDF parsing, Chroma, sync Ollama) runs here, never on the event loop
+BACKEND_IO_WORKERS = int(os.getenv("BACKEND_IO_WORKERS", "8"))
+blocking_pool = ThreadPoolExecutor(max_workers=BACKEND_IO_WORKERS, thread_name_prefix="backend-io")
+
+# Every LLM call goes through the process-wide scheduler (shared with AgenticRAG):
+# at most OLLAMA_MAX_CONCURRENCY in flight, interactive before batch, duplicates merged
+llm = get_scheduler()
+
+# DB_DIR holds a single shared collection: uploads/summaries on it must not interleave
+db_dir_lock = asyncio.Lock()
+
+# Map/combine outputs of mode="mapreduce" summaries, keyed by chunk hashes + model
+summary_cache = SummaryCache()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call in the bounded thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    # carry context vars (e.g. the current metrics trace) into the worker thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_pool, ctx.run, functools.partial(fn, *args, **kwargs))
+
+
+async def ollama_chat_async(model: str, messages: list, priority: int = INTERACTIVE, **kwargs):
+    """Non-blocking ollama chat through the LLM scheduler."""
+    return await llm.achat(model, messages, priority=priority, **kwargs)
+
+
+async def ollama_chat_stream(model: str, messages: list, priority: int = INTERACTIVE, **kwargs):
+    """Yield content tokens as Ollama produces them; holds an LLM slot for the whole stream."""
+    async for token in llm.astream(model, messages, priority=priority, **kwargs):
+        yield token
+
+
+async def ollama_chat_text(model: str, messages: list, priority: int = INTERACTIVE) -> str:
+    response = await ollama_chat_async(model, messages, priority=priority)
+    return response["message"]["content"]
+
+
+async def ollama_chat_text_batch(model: str, messages: list) -> str:
+    """ollama_chat_text queued behind interactive requests (map steps, batch Q&A)."""
+    return await ollama_chat_text(model, messages, priority=BATCH)
+
+
+def save_upload_file(upload: UploadFile, dest_path: str) -> tuple:
+    """Stream an upload to disk in fixed-size chunks (blocking). Returns (size, sha256 hex)."""
+    if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(UPLOAD_MAX_BYTES)
+    return copy_upload(upload.file, dest_path)
+
+
+def upload_too_large(e: UploadTooLarge) -> JSONResponse:
+    return JSONResponse(status_code=413, content={"error": str(e)})
+
+
+# Endpoints taking a PDF upload: oversized bodies are refused before they're read
+UPLOAD_PATHS = {"/upload-and-summarize/", "/upload-pdf-only/", "/rag-upload-pdf/"}
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    if (request.method == "POST" and request.url.path in UPLOAD_PATHS
+            and content_length_too_large(request.headers.get("content-length"))):
+        return upload_too_large(UploadTooLarge(UPLOAD_MAX_BYTES))
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Request count and latency per route/status for /metrics."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        registry.inc("http_requests_total", help="HTTP requests handled",
+                     method=request.method, path=path, status=status)
+        registry.observe("http_request_duration_seconds", time.perf_counter() - start,
+                         help="HTTP request latency (streamed bodies: until headers are sent)",
+                         method=request.method, path=path)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -53,13 +167,78 @@ app.add_middleware(
 # -------------------------------
 def reset_chroma():
     """Drop and recreate collection instead of deleting folder."""
-    client = chromadb.PersistentClient(path=DB_DIR)
+    client = chroma_pool.get_client(DB_DIR)
+    chroma_pool.forget_collection(DB_DIR, COLLECTION_NAME)
     try:
         client.delete_collection(COLLECTION_NAME)
     except Exception:
         pass  # ignore if it doesn’t exist
     client.create_collection(COLLECTION_NAME)
+    return chroma_pool.get_collection(DB_DIR, COLLECTION_NAME)
+
+
+def index_into_db_dir(dest_path: str, filename: str, max_chars: int, overlap: int,
+                      content_hash: str | None = None):
+    """
+    Extract, chunk and store a saved PDF into DB_DIR, reusing the upload cache.
+    Pass content_hash if it's already known (computed during the upload copy).
+    Returns the number of chunks stored, or 0 if the PDF has no text.
+    """
+    key = cache_key(content_hash or sha256_file(dest_path), CHROMA_EMBED_MODEL,
+                    chunker="extract_and_store", max_chars=max_chars, overlap=overlap)
+    cached = upload_cache.get(key)
+    if cached is not None:
+        # Cache hit: replay stored chunks + vectors, no extraction or embedding
+        if cached.get("metadatas"):
+            cached["metadatas"] = [{**m, "source": filename} if m else m for m in cached["metadatas"]]
+        collection = reset_chroma()
+        add_cached_chunks(collection, cached)
+        return len(cached["documents"])
+
+    text = extract_text_from_pdf(dest_path)
+    if not text.strip():
+        return 0
+
+    # Reset chroma (overwrite old DB)
+    collection = reset_chroma()
 
+    # Chunk + store (through the pooled client, not a second one on the same path)
+    chunks = chunk_text(text, max_chars=max_chars, overlap=overlap)
+    metas = [{"source": filename, "chunk_index": i} for i in range(len(chunks))]
+    batch_size = min(RAG_ADD_BATCH_SIZE, chroma_pool.get_client(DB_DIR).get_max_batch_size())
+    add_chunks_batched(collection, chunks, id_prefix="chunk", batch_size=batch_size, metadatas=metas)
+
+    snapshot = snapshot_collection(collection)
+    upload_cache.put(key, snapshot["documents"], embeddings=snapshot["embeddings"],
+                     metadatas=snapshot["metadatas"], ids=snapshot["ids"])
+    return len(chunks)
+
+
+
+def load_db_dir_chunks() -> list:
+    """Texts of the chunks currently in DB_DIR, in document order."""
+    collection = chroma_pool.get_collection(DB_DIR, COLLECTION_NAME)
+    data = collection.get(include=["documents", "metadatas"])
+    order = sorted(range(len(data["ids"])),
+                   key=lambda i: ((data["metadatas"][i] or {}).get("chunk_index", i), i))
+    return [data["documents"][i] for i in order]
+
+
+async def summarize_db_dir(query: str, model: str, mode: str) -> dict:
+    """
+    mode="single" sends the whole DB_DIR to summarize() in one request; mode="mapreduce"
+    summarizes chunk groups concurrently, then reduces (cached partials are reused).
+    Caller holds db_dir_lock.
+    """
+    if mode not in ("single", "mapreduce"):
+        raise ValueError(f"Unknown summary mode: {mode}")
+    if mode == "mapreduce":
+        chunks = await run_blocking(load_db_dir_chunks)
+        result = await mapreduce_summarize(chunks, query, model, ollama_chat_text_batch, summary_cache)
+        return {**result, "mode": mode}
+    # summarize() calls Ollama itself: run it in an LLM scheduler slot
+    summary = await asyncio.wrap_future(llm.run(functools.partial(summarize, DB_DIR, query, model=model)))
+    return {"summary": summary, "mode": "single"}
 
 
 # -------------------------------
@@ -72,35 +251,31 @@ async def upload_and_summarize(
     overlap: int = Form(200),
     model: str = Form("gemma3:1b"),
     query: str = Form("Summarize this PDF"),
+    mode: str = Form("single"),
 ):
     try:
         # Save uploaded file
         dest_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(dest_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-
-        # Extract text
-        text = extract_text_from_pdf(dest_path)
-        if not text.strip():
-            return JSONResponse(status_code=400, content={"error": "No text found in PDF"})
-
-        # Reset chroma (overwrite old DB)
-        reset_chroma()
+        _, content_hash = await run_blocking(save_upload_file, file, dest_path)
 
-        # Chunk + store
-        chunks = chunk_text(text, max_chars=max_chars, overlap=overlap)
-        metas = [{"source": file.filename, "chunk_index": i} for i in range(len(chunks))]
-        store_in_chroma(chunks, metas, db_dir=DB_DIR, collection_name=COLLECTION_NAME)
+        async with db_dir_lock:
+            # Extract, chunk + store (skipped on an upload cache hit)
+            num_chunks = await run_blocking(index_into_db_dir, dest_path, file.filename, max_chars, overlap,
+                                            content_hash)
+            if not num_chunks:
+                return JSONResponse(status_code=400, content={"error": "No text found in PDF"})
 
-        # Summarize
-        summary = summarize(DB_DIR, query, model=model)
+            # Summarize ("single" or "mapreduce")
+            result = await summarize_db_dir(query, model, mode)
         return {
             "message": "success",
             "filename": file.filename,
-            "num_chunks": len(chunks),
-            "summary": summary,
+            "num_chunks": num_chunks,
+            **result,
         }
 
+    except UploadTooLarge as e:
+        return upload_too_large(e)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -116,23 +291,18 @@ async def upload_pdf_only(
 ):
     try:
         dest_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(dest_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        _, content_hash = await run_blocking(save_upload_file, file, dest_path)
 
-        text = extract_text_from_pdf(dest_path)
-        if not text.strip():
+        async with db_dir_lock:
+            num_chunks = await run_blocking(index_into_db_dir, dest_path, file.filename, max_chars, overlap,
+                                            content_hash)
+        if not num_chunks:
             return JSONResponse(status_code=400, content={"error": "No text found in PDF"})
 
-        # Reset chroma
-        reset_chroma()
-
-        # Chunk + store
-        chunks = chunk_text(text, max_chars=max_chars, overlap=overlap)
-        metas = [{"source": file.filename, "chunk_index": i} for i in range(len(chunks))]
-        store_in_chroma(chunks, metas, db_dir=DB_DIR, collection_name=COLLECTION_NAME)
-
-        return {"message": "indexed", "filename": file.filename, "num_chunks": len(chunks)}
+        return {"message": "indexed", "filename": file.filename, "num_chunks": num_chunks}
 
+    except UploadTooLarge as e:
+        return upload_too_large(e)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -144,10 +314,12 @@ async def upload_pdf_only(
 async def summarize_existing(
     query: str = Form("Summarize this PDF"),
     model: str = Form("gemma3:1b"),
+    mode: str = Form("single"),
 ):
     try:
-        summary = summarize(DB_DIR, query, model=model)
-        return {"message": "success", "summary": summary}
+        async with db_dir_lock:
+            result = await summarize_db_dir(query, model, mode)
+        return {"message": "success", **result}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 # -------------------------------
@@ -157,6 +329,7 @@ async def summarize_existing(
 # =====================================================
 
 import os
+import glob
 import shutil
 import uuid
 import json
@@ -164,12 +337,9 @@ from fastapi import UploadFile, File, Form
 from fastapi.responses import JSONResponse
 
 # PDF & text splitting
-from PyPDF2 import PdfReader
+from pdf_extract import extract_text, shutdown_pool
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-# Vector DB
-import chromadb
-
 # Ollama client
 from ollama import Client
 
@@ -181,38 +351,46 @@ ollama = Client()
 # -------------------------
 RAG_DB_DIR = "rag_db"
 RAG_HISTORY_DIR = "rag_history"
+RAG_UPLOAD_DIR = "uploads"
 os.makedirs(RAG_DB_DIR, exist_ok=True)
 os.makedirs(RAG_HISTORY_DIR, exist_ok=True)
 
+# All sessions share one collection; chunks carry session_id metadata and every query
+# filters on it. Sessions from before this layout keep their own rag_db/<session_id> DB.
+RAG_SHARED_DB_DIR = os.path.join(RAG_DB_DIR, "shared")
+RAG_SHARED_COLLECTION = "rag_sessions"
+chroma_pool.pin(RAG_SHARED_DB_DIR)
+
+
 # -------------------------
 # Helper functions
 # -------------------------
-def get_history_file(session_id: str, rag: bool = False):
-    base = RAG_HISTORY_DIR if rag else "history"
-    return os.path.join(base, f"{session_id}.json")
+# /rag-qa-batch/: answers generated at once per batch, and questions accepted per batch
+RAG_BATCH_CONCURRENCY = int(os.getenv("RAG_BATCH_CONCURRENCY", "2"))
+RAG_BATCH_MAX_QUESTIONS = int(os.getenv("RAG_BATCH_MAX_QUESTIONS", "500"))
+
+# Append-only JSONL history per session; prompts only get the recent window
+history_store = HistoryStore(RAG_HISTORY_DIR)
 
-def load_history(file_path: str):
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
-    return []
+# Which sessions exist, their uploads and when they were last used (drives the reaper)
+sessions = SessionStore(os.path.join(RAG_DB_DIR, "sessions.sqlite3"))
+reaper_task = None
 
-def save_history(history, file_path: str):
-    with open(file_path, "w") as f:
-        json.dump(history, f, indent=2)
+# Same embedding function Chroma uses for collections created without one. Embedding
+# ourselves lets /rag-qa/ time the query embedding separately from the vector search,
+# and lets uploads cache their vectors without reading the shared collection back.
+rag_embedder = embedding_functions.DefaultEmbeddingFunction()
+
+# Token budget for retrieved PDF context in /rag-qa/ prompts
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", str(CONTEXT_TOKEN_BUDGET)))
 
 def chunk_pdf(file_path: str, max_chars: int = 1000, overlap: int = 200):
+    # Pages are parsed in parallel across the process pool and joined once
     try:
-        reader = PdfReader(file_path)
+        text = extract_text(file_path, engine="pypdf2")
     except Exception as e:
         raise Exception(f"Failed to read PDF: {e}")
 
-    text = ""
-    for page in reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-            text += page_text
-
     if not text.strip():
         raise Exception("PDF contains no extractable text")
 
@@ -223,6 +401,179 @@ def chunk_pdf(file_path: str, max_chars: int = 1000, overlap: int = 200):
     )
     return splitter.split_text(text)
 
+def build_session_db(session_id: str, file_location: str, content_hash: str, max_chars: int, overlap: int):
+    """
+    Chunk + embed an uploaded PDF into the shared collection under session_id,
+    reusing the upload cache. Returns (num_chunks, cache_hit).
+    """
+    # Same PDF + same chunking already built? Reuse its chunks and vectors.
+    key = cache_key(content_hash, CHROMA_EMBED_MODEL,
+                    chunker="recursive_character", max_chars=max_chars, overlap=overlap)
+    cached = upload_cache.get(key)
+
+    client = chroma_pool.get_client(RAG_SHARED_DB_DIR)
+    collection = chroma_pool.get_collection(RAG_SHARED_DB_DIR, RAG_SHARED_COLLECTION)
+
+    if cached is not None:
+        chunks, embeddings = cached["documents"], cached["embeddings"]
+    else:
+        chunks = chunk_pdf(file_location, max_chars, overlap)
+        embeddings = rag_embedder(chunks) if chunks else []
+        upload_cache.put(key, chunks, embeddings=embeddings)
+
+    # Chroma rejects adds above the client's max batch size
+    batch_size = min(RAG_ADD_BATCH_SIZE, client.get_max_batch_size())
+    metadatas = [{"session_id": session_id, "chunk_id": str(i)} for i in range(len(chunks))]
+    add_chunks_batched(collection, chunks, id_prefix=session_id, batch_size=batch_size,
+                       metadatas=metadatas, embeddings=embeddings)
+    # the session's chunks changed: answers cached for it are stale
+    answer_cache.invalidate_sources([session_id])
+    return len(chunks), cached is not None
+
+
+def valid_session_id(session_id: str) -> bool:
+    """Session ids are the uuid4 strings /rag-upload-pdf/ hands out; anything else is rejected."""
+    try:
+        return str(uuid.UUID(session_id)) == session_id
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+def legacy_db_dir(session_id: str) -> str | None:
+    """rag_db/<session_id> of a pre-shared-collection session, if it exists (and really is in RAG_DB_DIR)."""
+    if not valid_session_id(session_id):
+        return None
+    legacy_dir = os.path.join(RAG_DB_DIR, session_id)
+    if not os.path.isdir(legacy_dir) or os.path.islink(legacy_dir):
+        return None
+    if os.path.dirname(os.path.realpath(legacy_dir)) != os.path.realpath(RAG_DB_DIR):
+        return None
+    return legacy_dir
+
+
+def resolve_session(session_id: str):
+    """
+    (db path, collection name, where) to query for a session (see query_session), or None
+    if it doesn't exist. Old per-session databases are still served (and registered so
+    the reaper sees them).
+    """
+    if not valid_session_id(session_id):
+        return None
+    if sessions.touch(session_id):
+        if not sessions.get(session_id)["legacy"]:
+            chroma_pool.get_collection(RAG_SHARED_DB_DIR, RAG_SHARED_COLLECTION)
+            return RAG_SHARED_DB_DIR, RAG_SHARED_COLLECTION, {"session_id": session_id}
+    legacy_dir = legacy_db_dir(session_id)
+    if legacy_dir is None:
+        return None
+    if sessions.get(session_id) is None:
+        sessions.create(session_id, legacy=True)
+    chroma_pool.get_collection(legacy_dir, "pdf_chunks")
+    return legacy_dir, "pdf_chunks", None
+
+
+def query_session(resolved: tuple, **kwargs):
+    """collection.query() on a resolved session, leased so the pool can't close its DB mid-query."""
+    path, name, where = resolved
+    with chroma_pool.lease(path):
+        return chroma_pool.get_collection(path, name).query(where=where, **kwargs)
+
+
+def path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def remove_session_files(session_id: str, upload_path: str | None = None) -> int:
+    """Delete a session's upload(s), history and legacy DB dir. Returns bytes freed."""
+    if not valid_session_id(session_id):
+        return 0
+    paths = glob.glob(os.path.join(RAG_UPLOAD_DIR, glob.escape(session_id) + "_*"))
+    if upload_path and upload_path not in paths and os.path.exists(upload_path):
+        paths.append(upload_path)
+    paths += [p for p in (history_store.path(session_id),
+                          os.path.join(RAG_HISTORY_DIR, f"{session_id}.json")) if os.path.exists(p)]
+    freed = 0
+    for path in paths:
+        freed += path_size(path)
+        os.remove(path)
+    legacy_dir = legacy_db_dir(session_id)
+    if legacy_dir is not None:
+        chroma_pool.close(legacy_dir)
+        freed += path_size(legacy_dir)
+        shutil.rmtree(legacy_dir, ignore_errors=True)
+    answer_cache.invalidate_sources([session_id])
+    return freed
+
+
+def discard_session(session_id: str, upload_path: str | None = None):
+    """Remove a session whose upload failed: any chunks already added, the upload, its row."""
+    try:
+        collection = chroma_pool.get_collection(RAG_SHARED_DB_DIR, RAG_SHARED_COLLECTION)
+        collection.delete(where={"session_id": session_id})
+        remove_session_files(session_id, upload_path)
+        sessions.delete(session_id)
+    except Exception:
+        # the row stays registered, so the reaper retries later
+        import traceback
+        traceback.print_exc()
+
+
+def reap_expired_sessions(ttl: float = RAG_SESSION_TTL) -> dict:
+    """
+    Drop sessions idle for longer than ttl: their chunks in the shared collection,
+    uploads, history and any legacy DB dir. Unregistered legacy dirs are judged by mtime.
+    Returns what was reclaimed.
+    """
+    report = {"sessions": 0, "chunks": 0, "bytes": 0}
+    expired = sessions.expired(ttl)
+    if expired:
+        collection = chroma_pool.get_collection(RAG_SHARED_DB_DIR, RAG_SHARED_COLLECTION)
+    for session in expired:
+        sid = session["session_id"]
+        if not session["legacy"]:
+            where = {"session_id": sid}
+            report["chunks"] += len(collection.get(where=where, include=[])["ids"])
+            collection.delete(where=where)
+        report["bytes"] += remove_session_files(sid, session["upload_path"])
+        sessions.delete(sid)
+        report["sessions"] += 1
+
+    cutoff = time.time() - ttl
+    for name in os.listdir(RAG_DB_DIR):
+        path = legacy_db_dir(name)
+        if path is not None and sessions.get(name) is None and os.path.getmtime(path) < cutoff:
+            report["bytes"] += remove_session_files(name)
+            report["sessions"] += 1
+
+    for name, value in report.items():
+        registry.inc(f"rag_reaped_{name}_total", value, help="Reclaimed by the session reaper")
+    return report
+
+
+async def session_reaper():
+    """Background loop: every RAG_REAPER_INTERVAL seconds close idle Chroma clients and reap expired sessions."""
+    while True:
+        await asyncio.sleep(RAG_REAPER_INTERVAL)
+        try:
+            # idle Chroma clients are otherwise only closed when the pool is next used
+            await run_blocking(chroma_pool.evict_idle)
+            report = await run_blocking(reap_expired_sessions)
+            if report["sessions"]:
+                print(f"🧹 Reaped {report['sessions']} sessions, {report['chunks']} chunks, "
+                      f"{report['bytes'] / 1e6:.1f} MB")
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
 # -------------------------
 # Upload PDF and create RAG DB
 # -------------------------
@@ -233,93 +584,302 @@ async def rag_upload_pdf(
     overlap: int = Form(200)
 ):
     """
-    Upload a PDF, split into chunks, and store into a dedicated RAG vector DB.
+    Upload a PDF, split into chunks, and store them in the shared RAG collection.
     Returns a session_id for later queries.
     """
+    session_id = str(uuid.uuid4())
+    file_location = f"{RAG_UPLOAD_DIR}/{session_id}_{file.filename}"
     try:
-        session_id = str(uuid.uuid4())
-        os.makedirs("uploads", exist_ok=True)
-        file_location = f"uploads/{session_id}_{file.filename}"
-
-        with open(file_location, "wb") as f:
-            f.write(await file.read())
-
-        # Chunk PDF
-        chunks = chunk_pdf(file_location, max_chars, overlap)
-
-        # Create vector DB
-        pdf_db_dir = os.path.join(RAG_DB_DIR, session_id)
-        if os.path.exists(pdf_db_dir):
-            shutil.rmtree(pdf_db_dir)
-        os.makedirs(pdf_db_dir, exist_ok=True)
+        os.makedirs(RAG_UPLOAD_DIR, exist_ok=True)
+        # Registered before anything is written, so the reaper can always find the
+        # upload and chunks even if the process dies halfway through
+        await run_blocking(sessions.create, session_id, file.filename, file_location)
 
-        client = chromadb.PersistentClient(path=pdf_db_dir)
-        collection = client.create_collection("pdf_chunks")
+        # Streamed to disk in fixed-size chunks and hashed during the copy (never read whole)
+        _, content_hash = await run_blocking(save_upload_file, file, file_location)
 
-        for i, chunk in enumerate(chunks):
-            collection.add(ids=[f"{session_id}_{i}"], documents=[chunk])
+        # Parsing, embedding and Chroma writes all block: keep them off the event loop
+        num_chunks, cached = await run_blocking(
+            build_session_db, session_id, file_location, content_hash, max_chars, overlap
+        )
+        await run_blocking(sessions.set_num_chunks, session_id, num_chunks)
 
         return {
             "message": "success",
             "filename": file.filename,
-            "num_chunks": len(chunks),
-            "session_id": session_id
+            "num_chunks": num_chunks,
+            "session_id": session_id,
+            "cached": cached
         }
+    except UploadTooLarge as e:
+        await run_blocking(discard_session, session_id, file_location)
+        return upload_too_large(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
+        await run_blocking(discard_session, session_id, file_location)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 # -------------------------
 # RAG-based Q&A
 # -------------------------
+async def stream_rag_answer(model: str, messages: list, query: str, chat_history: list,
+                            session_id: str, persistent: bool, start: float,
+                            cache_ctx: str | None = None, query_embedding=None, cached: str | None = None):
+    """
+    NDJSON body for /rag-qa/ with stream=true; history is saved once the stream finishes.
+    A cached answer is sent as a single token; a generated one is stored under cache_ctx.
+    """
+    parts = []
+    ttft_ms = None
+    if cached is not None:
+        parts.append(cached)
+        ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+        yield json.dumps({"token": cached}) + "\n"
+    else:
+        try:
+            with stage("rag_qa", "llm"):
+                async for token in ollama_chat_stream(model, messages):
+                    if ttft_ms is None:
+                        ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+                    parts.append(token)
+                    yield json.dumps({"token": token}) + "\n"
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield json.dumps({"done": True, "error": str(e)}) + "\n"
+            return
+
+    answer = "".join(parts)
+    if cached is None and cache_ctx is not None:
+        answer_cache.put(cache_ctx, query, answer, embedding=query_embedding, sources=[session_id])
+    turn = [{"role": "user", "content": query}, {"role": "assistant", "content": answer}]
+    chat_history.extend(turn)
+    if persistent:
+        await run_blocking(history_store.append, session_id, turn)
+
+    yield json.dumps({
+        "done": True,
+        "message": "success",
+        "answer": answer,
+        "chat_history": chat_history,
+        "cached": cached is not None,
+        "ttft_ms": ttft_ms,
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+    }) + "\n"
+
 @app.post("/rag-qa/")
 async def rag_qa(
     query: str = Form(...),
     session_id: str = Form(...),
     model: str = Form("gemma3:1b"),
     n_results: int = Form(5),
-    persistent: bool = Form(True)
+    persistent: bool = Form(True),
+    stream: bool = Form(False),
+    history_turns: int = Form(HISTORY_MAX_TURNS),
+    history_tokens: int = Form(HISTORY_MAX_TOKENS),
+    debug: bool = Form(False)
 ):
     """
     Query the RAG DB for the given session_id and return an answer with context + history.
+    With stream=true the answer is sent as NDJSON: one {"token": ...} line per token,
+    then a final {"done": true, ...} line with the usual payload plus ttft_ms/total_ms.
+    Only the last history_turns turns (within ~history_tokens tokens) go into the prompt,
+    and chat_history in the response is that window plus the new turn.
+    With debug=true the (non-streamed) response includes a per-stage timing breakdown.
+    Answers to a question already asked over the same chunks, model and history window
+    come from the answer cache and are marked "cached": true.
     """
+    with start_trace() as trace:
+        return await _rag_qa(query, session_id, model, n_results, persistent, stream,
+                             history_turns, history_tokens, debug, trace)
+
+
+def build_rag_messages(session_id: str, ids: list, chunks: list, model: str, chat_history: list,
+                       query: str, pipeline: str = "rag_qa"):
+    """Pack the retrieved chunks into the token budget and build the chat messages.
+    Returns (messages, packed, prompt_chars)."""
+    observe_size("rag_retrieved_chunks", len(chunks), help="Chunks returned by retrieval", pipeline=pipeline)
+    # chunk_pdf chunks overlap: stitch neighbours (ids are "<session>_<i>") and fit the token budget
+    with stage(pipeline, "context_pack"):
+        retrieved = [{"text": doc, "meta": {"source": session_id, "chunk_id": chunk_id.rsplit("_", 1)[-1]}}
+                     for chunk_id, doc in zip(ids, chunks)]
+        packed = pack_context(retrieved, model, budget_tokens=RAG_CONTEXT_TOKENS, header_fn=None)
+    context = packed["context"] if packed["items"] else "No relevant context found."
+    observe_size("rag_context_tokens", packed["tokens"], help="Packed context size in tokens", pipeline=pipeline)
+
+    # Build messages
+    system_message = {
+        "role": "system",
+        "content": "You are an assistant answering based on the PDF context and chat history."
+    }
+    context_message = {"role": "system", "content": f"Relevant PDF context:\n{context}"}
+    messages = [system_message, context_message] + chat_history + [{"role": "user", "content": query}]
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    observe_size("rag_prompt_chars", prompt_chars, help="Prompt size sent to the LLM", pipeline=pipeline)
+    return messages, packed, prompt_chars
+
+
+async def _rag_qa(query, session_id, model, n_results, persistent, stream,
+                  history_turns, history_tokens, debug, trace):
     try:
-        pdf_db_dir = os.path.join(RAG_DB_DIR, session_id)
-        if not os.path.exists(pdf_db_dir):
+        start = time.perf_counter()
+        # Find the session's chunks (client + collection stay open across questions)
+        with stage("rag_qa", "chroma_open"):
+            resolved = await run_blocking(resolve_session, session_id)
+        if resolved is None:
             return JSONResponse(status_code=404, content={"error": "No DB found for this session"})
 
-        # Load chat history
-        history_file = get_history_file(session_id, rag=True)
-        chat_history = load_history(history_file) if persistent else []
-
-        # Query vector DB
-        client = chromadb.PersistentClient(path=pdf_db_dir)
-        collection = client.get_or_create_collection("pdf_chunks")
-
-        results = collection.query(query_texts=[query], n_results=n_results)
+        # Load the recent window of chat history (tail read, bounded size)
+        with stage("rag_qa", "history_load"):
+            chat_history = await run_blocking(
+                history_store.recent, session_id, history_turns, history_tokens
+            ) if persistent else []
+
+        with stage("rag_qa", "embed"):
+            query_embeddings = await run_blocking(rag_embedder, [query])
+        with stage("rag_qa", "vector_query"):
+            results = await run_blocking(query_session, resolved, query_embeddings=query_embeddings,
+                                         n_results=n_results)
+        ids = results["ids"][0] if results["ids"] else []
         chunks = results["documents"][0] if results["documents"] else []
-        context = "\n\n".join(chunks) if chunks else "No relevant context found."
 
-        # Build messages
-        system_message = {
-            "role": "system",
-            "content": "You are an assistant answering based on the PDF context and chat history."
-        }
-        context_message = {"role": "system", "content": f"Relevant PDF context:\n{context}"}
-        messages = [system_message, context_message] + chat_history + [{"role": "user", "content": query}]
+        # Answer cache: keyed on chunk position + text (not the session id, so the same PDF
+        # uploaded in another session shares answers), model and the history window
+        cache_ctx = context_key(model, [(i.rsplit("_", 1)[-1], doc) for i, doc in zip(ids, chunks)],
+                                extra=json.dumps(chat_history, sort_keys=True))
+        with stage("rag_qa", "answer_cache"):
+            cached = answer_cache.get(cache_ctx, query, embedding=query_embeddings[0])
+
+        # A hit skips packing; token counting may load the model's tokenizer on first use,
+        # so it runs off the event loop
+        messages, packed, prompt_chars = None, None, 0
+        if cached is None:
+            messages, packed, prompt_chars = await run_blocking(
+                build_rag_messages, session_id, ids, chunks, model, chat_history, query)
+
+        if stream:
+            return StreamingResponse(
+                stream_rag_answer(model, messages, query, chat_history, session_id, persistent, start,
+                                  cache_ctx=cache_ctx, query_embedding=query_embeddings[0], cached=cached),
+                media_type="application/x-ndjson",
+            )
+
+        if cached is not None:
+            answer = cached
+        else:
+            # Call Ollama (async, through the LLM scheduler)
+            with stage("rag_qa", "llm"):
+                response = await ollama_chat_async(model, messages)
+            answer = response["message"]["content"]
+            answer_cache.put(cache_ctx, query, answer, embedding=query_embeddings[0], sources=[session_id])
+
+        # Save history (one O(1) append per turn)
+        turn = [{"role": "user", "content": query}, {"role": "assistant", "content": answer}]
+        chat_history.extend(turn)
+        if persistent:
+            with stage("rag_qa", "history_save"):
+                await run_blocking(history_store.append, session_id, turn)
+
+        result = {"message": "success", "answer": answer, "chat_history": chat_history,
+                  "cached": cached is not None,
+                  "total_ms": round((time.perf_counter() - start) * 1000, 1)}
+        if debug:
+            result["debug"] = {"timings_ms": dict(trace), "retrieved_chunks": len(chunks),
+                               "context_tokens": packed["tokens"] if packed else 0,
+                               "prompt_chars": prompt_chars}
+        return result
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+# -------------------------------
 
-        # Call Ollama
-        response = ollama.chat(model=model, messages=messages)
-        answer = response["message"]["content"]
 
-        # Save history
-        chat_history.append({"role": "user", "content": query})
-        chat_history.append({"role": "assistant", "content": answer})
-        if persistent:
-            save_history(chat_history, history_file)
+# -------------------------
+# Batch Q&A (question banks against one session)
+# -------------------------
+def parse_queries(queries: str) -> list:
+    """A JSON array of strings, or one question per line."""
+    text = queries.strip()
+    if text.startswith("["):
+        items = json.loads(text)
+    else:
+        items = text.splitlines()
+    return [str(q).strip() for q in items if str(q).strip()]
+
+
+async def stream_batch_answers(model: str, questions: list, messages: list, concurrency: int, start: float):
+    """NDJSON body for /rag-qa-batch/: one line per answer in completion order, then a done line."""
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(i: int) -> dict:
+        async with slots:
+            try:
+                with stage("rag_qa_batch", "llm"):
+                    text = await ollama_chat_text_batch(model, messages[i])
+                return {"index": i, "query": questions[i], "answer": text}
+            except Exception as e:
+                return {"index": i, "query": questions[i], "error": str(e)}
+
+    tasks = [asyncio.create_task(answer(i)) for i in range(len(questions))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done) + "\n"
+        yield json.dumps({"done": True, "count": len(questions),
+                          "total_ms": round((time.perf_counter() - start) * 1000, 1)}) + "\n"
+    finally:
+        # client went away: don't keep generating answers nobody reads
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/rag-qa-batch/")
+async def rag_qa_batch(
+    queries: str = Form(...),
+    session_id: str = Form(...),
+    model: str = Form("gemma3:1b"),
+    n_results: int = Form(5),
+    concurrency: int = Form(RAG_BATCH_CONCURRENCY)
+):
+    """
+    Answer a list of questions (JSON array or one per line) against one session.
+    All questions are embedded in one batch and looked up with one vector query; answers
+    are generated with at most `concurrency` Ollama calls in flight (still under
+    OLLAMA_MAX_CONCURRENCY) and streamed back as NDJSON as they complete:
+    {"index", "query", "answer"} (or "error") per question, then {"done": true, ...}.
+    Batch questions don't go into the session's chat history.
+    """
+    try:
+        start = time.perf_counter()
+        try:
+            questions = parse_queries(queries)
+        except ValueError:
+            return JSONResponse(status_code=400, content={"error": "queries must be a JSON array or one question per line"})
+        if not questions:
+            return JSONResponse(status_code=400, content={"error": "No questions given"})
+        if len(questions) > RAG_BATCH_MAX_QUESTIONS:
+            return JSONResponse(status_code=400,
+                                content={"error": f"At most {RAG_BATCH_MAX_QUESTIONS} questions per batch"})
+
+        resolved = await run_blocking(resolve_session, session_id)
+        if resolved is None:
+            return JSONResponse(status_code=404, content={"error": "No DB found for this session"})
 
-        return {"message": "success", "answer": answer, "chat_history": chat_history}
+        with stage("rag_qa_batch", "embed"):
+            query_embeddings = await run_blocking(rag_embedder, questions)
+        with stage("rag_qa_batch", "vector_query"):
+            results = await run_blocking(query_session, resolved, query_embeddings=query_embeddings,
+                                         n_results=n_results)
+        messages = await run_blocking(lambda: [
+            build_rag_messages(session_id, results["ids"][i], results["documents"][i], model, [], q,
+                               pipeline="rag_qa_batch")[0]
+            for i, q in enumerate(questions)
+        ])
+        return StreamingResponse(
+            stream_batch_answers(model, questions, messages, concurrency, start),
+            media_type="application/x-ndjson",
+        )
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -327,6 +887,69 @@ async def rag_qa(
 # -------------------------------
 
 
+# -------------------------------
+@app.get("/rag-pool-stats/")
+async def rag_pool_stats():
+    """Hit/miss counters of the Chroma client pool."""
+    return chroma_pool.stats()
+
+
+@app.get("/llm-stats/")
+async def llm_stats():
+    """Queue depth, running and merged (coalesced) requests of the LLM scheduler."""
+    return llm.stats()
+
+
+@app.get("/answer-cache-stats/")
+async def answer_cache_stats():
+    """Hits (exact and near-duplicate), misses and invalidations of the answer cache."""
+    return answer_cache.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: stage latencies, sizes, HTTP and pool stats."""
+    for name, value in chroma_pool.stats().items():
+        registry.set(f"chroma_pool_{name}", value, help="Chroma client pool statistics")
+    for name, value in llm.stats().items():
+        registry.set(f"llm_scheduler_{name}", value, help="LLM scheduler queue statistics")
+    for name, value in answer_cache.stats().items():
+        registry.set(f"answer_cache_{name}", float(value), help="Answer cache statistics")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/rag-gc/")
+async def rag_gc():
+    """Run the session reaper now (configured RAG_SESSION_TTL_HOURS) and report what was reclaimed."""
+    report = await run_blocking(reap_expired_sessions)
+    return {**report, "active_sessions": sessions.count()}
+
+
+@app.on_event("startup")
+async def start_session_reaper():
+    global reaper_task
+    reaper_task = asyncio.create_task(session_reaper())
+
+
+@app.on_event("startup")
+async def warm_up_models():
+    # load the model (and its tokenizer) in the background so the first user request doesn't pay for it
+    if OLLAMA_WARM_MODELS:
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(blocking_pool, llm.warm_up, OLLAMA_WARM_MODELS)
+        loop.run_in_executor(blocking_pool, warm_up_tokenizers, OLLAMA_WARM_MODELS)
+
+
+@app.on_event("shutdown")
+def close_chroma_clients():
+    if reaper_task is not None:
+        reaper_task.cancel()
+    chroma_pool.close_all()
+    sessions.close()
+    shutdown_pool()
+    blocking_pool.shutdown(wait=False)
+
+
 # -------------------------------
 @app.get("/")
 async def root():
@@ -0,0 +1,83 @@
+# bench_rag_upload.py
+"""
+Benchmark chunk insertion for /rag-upload-pdf/: one add() per chunk (old path)
+vs add_chunks_batched (new path). Prints chunks/sec for both.
+
+Usage:
+    python bench_rag_upload.py --chunks 2000 --batch-size 256
+    python bench_rag_upload.py --pdf some_textbook.pdf
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import chromadb
+
+from rag_ingest import add_chunks_batched, RAG_ADD_BATCH_SIZE
+
+
+def synthetic_chunks(n: int, max_chars: int = 1000):
+    base = ("Dynamic programming solves problems by combining solutions to overlapping subproblems. "
+            "A recurrence relation describes the optimal substructure of the problem. ")
+    text = base * (max_chars // len(base) + 1)
+    return [f"[{i}] " + text[:max_chars - 8] for i in range(n)]
+
+
+def bench_per_chunk(chunks):
+    db_dir = tempfile.mkdtemp(prefix="bench_rag_")
+    try:
+        client = chromadb.PersistentClient(path=db_dir)
+        collection = client.create_collection("pdf_chunks")
+        start = time.perf_counter()
+        for i, chunk in enumerate(chunks):
+            collection.add(ids=[f"bench_{i}"], documents=[chunk])
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+def bench_batched(chunks, batch_size: int):
+    db_dir = tempfile.mkdtemp(prefix="bench_rag_")
+    try:
+        client = chromadb.PersistentClient(path=db_dir)
+        collection = client.create_collection("pdf_chunks")
+        batch_size = min(batch_size, client.get_max_batch_size())
+        start = time.perf_counter()
+        add_chunks_batched(collection, chunks, id_prefix="bench", batch_size=batch_size,
+                           on_progress=lambda done, total: None)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG chunk insertion")
+    parser.add_argument("--chunks", type=int, default=1000, help="number of synthetic chunks")
+    parser.add_argument("--pdf", help="chunk this PDF instead of using synthetic text")
+    parser.add_argument("--batch-size", type=int, default=RAG_ADD_BATCH_SIZE)
+    parser.add_argument("--skip-per-chunk", action="store_true", help="only run the batched path")
+    args = parser.parse_args()
+
+    if args.pdf:
+        # imported lazily: backend.py pulls in the whole FastAPI app
+        from backend import chunk_pdf
+        chunks = chunk_pdf(args.pdf)
+    else:
+        chunks = synthetic_chunks(args.chunks)
+    print(f"Benchmarking {len(chunks)} chunks")
+
+    results = {}
+    if not args.skip_per_chunk:
+        results["per_chunk"] = bench_per_chunk(chunks)
+    results[f"batched(bs={args.batch_size})"] = bench_batched(chunks, args.batch_size)
+
+    for name, secs in results.items():
+        print(f"{name:>20}: {secs:8.2f}s  {len(chunks) / secs:10.1f} chunks/sec")
+    if "per_chunk" in results:
+        batched = results[f"batched(bs={args.batch_size})"]
+        print(f"Speedup: {results['per_chunk'] / batched:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
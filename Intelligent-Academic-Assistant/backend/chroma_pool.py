@@ -0,0 +1,208 @@
+# chroma_pool.py
+import os
+import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import chromadb
+
+# How many Chroma databases (one per RAG session) stay open, and for how long unused
+CHROMA_POOL_SIZE = int(os.getenv("CHROMA_POOL_SIZE", "32"))
+CHROMA_IDLE_TIMEOUT = float(os.getenv("CHROMA_IDLE_TIMEOUT", "600"))  # seconds
+
+
+def close_client(client):
+    """
+    chromadb has no public close(): stop the client's system and drop it from chromadb's
+    per-path cache so the next PersistentClient(path) opens a fresh one. Only called for
+    paths nothing outside the pool opens (see ChromaPool's pinned paths), once no lease
+    is using them, and only if the cached system is still this client's.
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+        systems = SharedSystemClient._identifier_to_system
+        if systems.get(client._identifier) is not client._system:
+            return  # already replaced: someone else owns the current system
+        systems.pop(client._identifier, None)
+    except Exception:
+        pass
+    try:
+        client._system.stop()
+    except Exception:
+        pass
+
+
+class ChromaPool:
+    """
+    LRU-bounded cache of open PersistentClients and their collections, keyed by
+    database path (i.e. by session). Entries idle longer than idle_timeout are closed
+    (call evict_idle() periodically; it also runs lazily on access).
+    pinned paths are never closed before close_all(): use them for databases that other
+    code also opens (chromadb shares one system per path between all its clients).
+    Work done inside lease(path) can't have its database closed underneath it.
+    """
+
+    def __init__(self, max_size: int = CHROMA_POOL_SIZE, idle_timeout: float = CHROMA_IDLE_TIMEOUT,
+                 pinned=()):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.pinned = {self._key(p) for p in pinned}
+        self._entries = OrderedDict()   # path -> {"client", "collections", "last_used", "users", "closing"}
+        self._lock = threading.Lock()
+        self._open_locks = {}           # path -> lock, so one session's cold open doesn't block others
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, path: str) -> str:
+        return os.path.abspath(path)
+
+    def _touch(self, key: str):
+        entry = self._entries[key]
+        entry["last_used"] = time.monotonic()
+        self._entries.move_to_end(key)
+        return entry
+
+    def _evictable(self, key: str) -> bool:
+        return key not in self.pinned and self._entries[key]["users"] == 0
+
+    def _pop_expired(self) -> list:
+        """Collect idle and over-capacity entries that are neither pinned nor leased (caller holds self._lock)."""
+        closed = []
+        now = time.monotonic()
+        for key in list(self._entries):
+            if now - self._entries[key]["last_used"] <= self.idle_timeout:
+                break  # ordered by recency: the rest are fresher
+            if self._evictable(key):
+                closed.append(self._entries.pop(key))
+                self._open_locks.pop(key, None)
+        # pinned databases don't take up pool slots; the newest entry is never evicted
+        excess = sum(key not in self.pinned for key in self._entries) - self.max_size
+        for key in list(self._entries)[:-1]:
+            if excess <= 0:
+                break
+            if self._evictable(key):
+                closed.append(self._entries.pop(key))
+                self._open_locks.pop(key, None)
+                excess -= 1
+        self.evictions += len(closed)
+        return closed
+
+    def _get_entry(self, path: str, lease: bool = False) -> dict:
+        key = self._key(path)
+        entry = None
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                entry = self._touch(key)
+                entry["users"] += lease
+                expired = self._pop_expired()
+            else:
+                open_lock = self._open_locks.setdefault(key, threading.Lock())
+
+        if entry is None:
+            with open_lock:
+                with self._lock:
+                    # someone else may have opened it while we waited
+                    if key in self._entries:
+                        self.hits += 1
+                        entry = self._touch(key)
+                        entry["users"] += lease
+                    else:
+                        self.misses += 1
+                if entry is None:
+                    client = chromadb.PersistentClient(path=key)
+                    with self._lock:
+                        self._entries[key] = {"client": client, "collections": {}, "last_used": time.monotonic(),
+                                              "users": int(lease), "closing": False}
+                        entry = self._touch(key)
+                with self._lock:
+                    expired = self._pop_expired()
+
+        # close evicted databases outside the lock
+        for old in expired:
+            if old is not entry:
+                close_client(old["client"])
+        return entry
+
+    def pin(self, path: str):
+        """Never close path's database before close_all()."""
+        with self._lock:
+            self.pinned.add(self._key(path))
+
+    def get_client(self, path: str):
+        return self._get_entry(path)["client"]
+
+    @contextmanager
+    def lease(self, path: str):
+        """Keep path's database open (not evicted or closed) for the duration of the block."""
+        entry = self._get_entry(path, lease=True)
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry["users"] -= 1
+                entry["last_used"] = time.monotonic()
+                close_now = entry["closing"] and entry["users"] == 0
+            if close_now:
+                close_client(entry["client"])
+
+    def get_collection(self, path: str, name: str, create: bool = True):
+        """Cached collection handle; create=False raises if the collection doesn't exist."""
+        entry = self._get_entry(path)
+        collection = entry["collections"].get(name)
+        if collection is None:
+            client = entry["client"]
+            collection = client.get_or_create_collection(name) if create else client.get_collection(name)
+            entry["collections"][name] = collection
+        return collection
+
+    def forget_collection(self, path: str, name: str):
+        """Drop a cached handle after the collection was deleted or recreated."""
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+            if entry:
+                entry["collections"].pop(name, None)
+
+    def close(self, path: str):
+        """Close a database, e.g. before its directory is removed (deferred while it's leased)."""
+        key = self._key(path)
+        with self._lock:
+            if key in self.pinned:
+                return
+            entry = self._entries.pop(key, None)
+            self._open_locks.pop(key, None)
+            if entry and entry["users"]:
+                entry["closing"] = True   # the last lease closes it
+                entry = None
+        if entry:
+            close_client(entry["client"])
+
+    def evict_idle(self) -> int:
+        """Close databases idle for longer than idle_timeout. Returns how many were closed."""
+        with self._lock:
+            expired = self._pop_expired()
+        for entry in expired:
+            close_client(entry["client"])
+        return len(expired)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._open_locks.clear()
+        for entry in entries:
+            close_client(entry["client"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "open": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -0,0 +1,150 @@
+# history_store.py
+import os
+import json
+import time
+import threading
+
+try:
+    import fcntl  # POSIX: also lock against writers in other worker processes
+except ImportError:
+    fcntl = None
+
+# Defaults for the window of history that goes into the prompt
+HISTORY_MAX_TURNS = int(os.getenv("RAG_HISTORY_MAX_TURNS", "6"))
+HISTORY_MAX_TOKENS = int(os.getenv("RAG_HISTORY_MAX_TOKENS", "1500"))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, plus per-message overhead
+    return len(text) // 4 + 4
+
+
+class HistoryStore:
+    """
+    Append-only chat history, one JSONL file per session (<base_dir>/<session_id>.jsonl).
+    Appending a turn is a single write at the end of the file; reading the recent
+    window only reads the tail of the file, so neither grows with conversation length.
+    """
+
+    def __init__(self, base_dir: str, read_block: int = 8192):
+        self.base_dir = base_dir
+        self.read_block = read_block
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+
+    def path(self, session_id: str) -> str:
+        return os.path.join(self.base_dir, f"{session_id}.jsonl")
+
+    def _lock(self, session_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def _migrate_legacy(self, session_id: str):
+        """
+        Convert an old whole-file <session_id>.json history to JSONL once. Runs under the
+        session lock; the JSONL file is published with os.link, which fails if another
+        process got there first, so concurrent first accesses never migrate twice.
+        """
+        legacy = os.path.join(self.base_dir, f"{session_id}.json")
+        path = self.path(session_id)
+        with self._lock(session_id):
+            if not os.path.exists(legacy) or os.path.exists(path):
+                return
+            try:
+                with open(legacy, "r") as f:
+                    messages = json.load(f)
+            except (OSError, ValueError):
+                return  # unreadable or already migrated and removed
+            tmp = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self._encode(messages))
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass  # another process migrated it meanwhile
+            finally:
+                os.remove(tmp)
+            try:
+                os.remove(legacy)
+            except FileNotFoundError:
+                pass
+
+    def append(self, session_id: str, messages: list):
+        """Append messages ({'role', 'content'}) in one write; safe across threads and processes."""
+        if not messages:
+            return
+        self._migrate_legacy(session_id)
+        self._write(session_id, messages)
+
+    @staticmethod
+    def _encode(messages: list) -> str:
+        ts = time.time()
+        return "".join(json.dumps({**m, "ts": ts}, ensure_ascii=False) + "\n" for m in messages)
+
+    def _write(self, session_id: str, messages: list):
+        data = self._encode(messages)
+        with self._lock(session_id):
+            with open(self.path(session_id), "a", encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(data)
+                    f.flush()
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _tail_lines(self, path: str, max_lines: int) -> list:
+        """Last max_lines complete lines of a file, read backwards in blocks."""
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b""
+            while pos > 0 and buf.count(b"\n") <= max_lines:
+                step = min(self.read_block, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+        lines = [line for line in buf.split(b"\n") if line.strip()]
+        if pos > 0:
+            lines = lines[1:]  # first line may be cut in the middle
+        return lines[-max_lines:]
+
+    def recent(self, session_id: str, max_turns: int = HISTORY_MAX_TURNS,
+               max_tokens: int | None = HISTORY_MAX_TOKENS) -> list:
+        """
+        The last max_turns user/assistant turns, further trimmed (oldest first) to
+        fit max_tokens. Returns [{'role', 'content'}, ...] in chronological order.
+        """
+        self._migrate_legacy(session_id)
+        path = self.path(session_id)
+        if not os.path.exists(path) or max_turns <= 0:
+            return []
+
+        messages = []
+        for line in self._tail_lines(path, max_turns * 2):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn write from a crashed process
+            messages.append({"role": record["role"], "content": record["content"]})
+
+        if max_tokens is not None:
+            kept, used = [], 0
+            for message in reversed(messages):
+                used += estimate_tokens(message["content"])
+                if used > max_tokens:
+                    break
+                kept.append(message)
+            messages = kept[::-1]
+
+        # never start the window with a dangling assistant reply
+        while messages and messages[0]["role"] != "user":
+            messages.pop(0)
+        return messages
+
+    def delete(self, session_id: str):
+        for path in (self.path(session_id), os.path.join(self.base_dir, f"{session_id}.json")):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,70 @@
+# loadtest_rag_qa.py
+"""
+Fire concurrent /rag-qa/ requests at a running backend and check that they
+overlap instead of being served one after another.
+
+Usage:
+    python loadtest_rag_qa.py --pdf notes.pdf --concurrency 8
+    python loadtest_rag_qa.py --session-id <existing session> --concurrency 8
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+QUESTIONS = [
+    "What is dynamic programming?",
+    "Explain the main topics covered in this document.",
+    "What are the key definitions?",
+    "Give an example from the text.",
+]
+
+
+async def upload(client: httpx.AsyncClient, pdf_path: str) -> str:
+    with open(pdf_path, "rb") as f:
+        resp = await client.post("/rag-upload-pdf/", files={"file": (pdf_path, f, "application/pdf")})
+    resp.raise_for_status()
+    return resp.json()["session_id"]
+
+
+async def ask(client: httpx.AsyncClient, session_id: str, query: str, model: str, t0: float):
+    start = time.perf_counter() - t0
+    resp = await client.post("/rag-qa/", data={
+        "query": query, "session_id": session_id, "model": model, "persistent": "false",
+    })
+    end = time.perf_counter() - t0
+    return {"start": start, "end": end, "status": resp.status_code}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrent /rag-qa/ load test")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--pdf", help="PDF to upload for a fresh session")
+    parser.add_argument("--session-id", help="reuse an existing session instead of uploading")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model", default="gemma3:1b")
+    args = parser.parse_args()
+    if not args.pdf and not args.session_id:
+        parser.error("pass --pdf or --session-id")
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=600) as client:
+        session_id = args.session_id or await upload(client, args.pdf)
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*[
+            ask(client, session_id, QUESTIONS[i % len(QUESTIONS)], args.model, t0)
+            for i in range(args.concurrency)
+        ])
+        wall = time.perf_counter() - t0
+
+    for i, r in enumerate(sorted(results, key=lambda r: r["start"])):
+        print(f"req {i:2d}: start {r['start']:6.2f}s  end {r['end']:6.2f}s  "
+              f"took {r['end'] - r['start']:6.2f}s  HTTP {r['status']}")
+
+    busy = sum(r["end"] - r["start"] for r in results)
+    # ~1.0 means requests ran back to back; >1 means they overlapped
+    print(f"Wall time {wall:.2f}s, summed latency {busy:.2f}s, average overlap {busy / wall:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
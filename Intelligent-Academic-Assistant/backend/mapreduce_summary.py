@@ -0,0 +1,190 @@
+# mapreduce_summary.py
+import os
+import json
+import asyncio
+import time
+import hashlib
+import threading
+
+# Map step: consecutive chunks are grouped up to this many characters per LLM call
+# (keeps each prompt well inside gemma3:1b's context)
+SUMMARY_GROUP_CHARS = int(os.getenv("SUMMARY_GROUP_CHARS", "6000"))
+# Map calls in flight per request (Ollama itself is still capped by OLLAMA_MAX_CONCURRENCY)
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+# Upper bound on map + combine levels, in case partial summaries refuse to shrink
+SUMMARY_MAX_LEVELS = 4
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", "summary_cache")
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_MB", "64")) * 1024 * 1024
+# Bump when the map prompt changes so old cached summaries aren't reused
+MAP_PROMPT_VERSION = "1"
+
+MAP_PROMPT = (
+    "Summarize the following part of a document in a few sentences. Keep key definitions, "
+    "results, numbers and names. Do not add anything that is not in the text.\n\n{text}"
+)
+COMBINE_PROMPT = (
+    "These are summaries of consecutive parts of a document. Merge them into one shorter "
+    "summary that keeps the key points in order.\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "These are summaries of consecutive parts of a document, in order.\n\n{text}\n\n"
+    "Using only these summaries, respond to: {query}"
+)
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    Partial summaries on disk, one small JSON file per (model, input chunks) key.
+    Least-recently-used files (by mtime, bumped on every hit) are evicted once the
+    cache grows past max_bytes.
+    """
+
+    def __init__(self, root: str = SUMMARY_CACHE_DIR, max_bytes: int = SUMMARY_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None   # bytes on disk, counted on the first put
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, kind: str, texts: list) -> str:
+        h = hashlib.sha256(f"{MAP_PROMPT_VERSION}|{model}|{kind}".encode("utf-8"))
+        for text in texts:
+            h.update(chunk_hash(text).encode("ascii"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                summary = json.load(f)["summary"]
+        except (OSError, ValueError, KeyError):
+            return None
+        # bump recency for LRU eviction
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return summary
+
+    def put(self, key: str, summary: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary}, f)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            try:
+                self._size -= os.path.getsize(path)   # overwriting an existing entry
+            except OSError:
+                pass
+            self._size += os.path.getsize(tmp)
+            os.replace(tmp, path)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self) -> list:
+        """(mtime, size, path) of every cached summary."""
+        entries = []
+        for sub in os.listdir(self.root):
+            sub_dir = os.path.join(self.root, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if not name.endswith(".json"):
+                    continue   # skips in-flight .tmp files
+                path = os.path.join(sub_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Remove least-recently-used summaries until the cache is back under 90% of
+        max_bytes, so a full cache doesn't rescan the directory on every put.
+        """
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._size = total
+
+
+def group_chunks(chunks: list, max_chars: int = SUMMARY_GROUP_CHARS) -> list:
+    """Consecutive chunks packed into groups of at most max_chars (a single long chunk stays alone)."""
+    groups, current, size = [], [], 0
+    for chunk in chunks:
+        if current and size + len(chunk) > max_chars:
+            groups.append(current)
+            current, size = [], 0
+        current.append(chunk)
+        size += len(chunk)
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def mapreduce_summarize(chunks: list, query: str, model: str, chat_fn, cache: SummaryCache,
+                              group_chars: int = SUMMARY_GROUP_CHARS,
+                              concurrency: int = SUMMARY_MAP_CONCURRENCY) -> dict:
+    """
+    Hierarchical summary: summarize chunk groups concurrently (map), merge the partial
+    summaries level by level until they fit one prompt (combine), then answer the
+    query from them (reduce). Map and combine outputs don't depend on the query and are
+    cached by chunk hashes + model, so a new query over the same PDF only re-runs reduce.
+    chat_fn(model, messages) is an async callable returning the reply text.
+    Returns {'summary', 'groups', 'cached_groups', 'levels'}.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    stats = {"groups": 0, "cached_groups": 0}
+
+    async def summarize_group(kind: str, prompt: str, texts: list) -> str:
+        key = cache.key(model, kind, texts)
+        # cache files are read and written off the event loop
+        cached = await asyncio.to_thread(cache.get, key)
+        stats["groups"] += 1
+        if cached is not None:
+            stats["cached_groups"] += 1
+            return cached
+        async with slots:
+            summary = await chat_fn(model, [{"role": "user", "content": prompt.format(text="\n\n".join(texts))}])
+        await asyncio.to_thread(cache.put, key, summary)
+        return summary
+
+    texts = [c for c in chunks if c.strip()]
+    if not texts:
+        return {"summary": "", **stats, "levels": 0}
+
+    partials = await asyncio.gather(*(summarize_group("map", MAP_PROMPT, g)
+                                      for g in group_chunks(texts, group_chars)))
+    levels = 1
+    while sum(len(p) for p in partials) > group_chars and len(partials) > 1 and levels < SUMMARY_MAX_LEVELS:
+        partials = await asyncio.gather(*(summarize_group("combine", COMBINE_PROMPT, g)
+                                          for g in group_chunks(partials, group_chars)))
+        levels += 1
+
+    reduce_prompt = REDUCE_PROMPT.format(text="\n\n".join(partials), query=query)
+    summary = await chat_fn(model, [{"role": "user", "content": reduce_prompt}])
+    return {"summary": summary, **stats, "levels": levels}
@@ -0,0 +1,72 @@
+# rag_ingest.py
+import os
+
+# Chunks are embedded + written in batches of this size (one add() per batch)
+RAG_ADD_BATCH_SIZE = int(os.getenv("RAG_ADD_BATCH_SIZE", "256"))
+
+
+def add_chunks_batched(collection, chunks, id_prefix: str = "chunk", batch_size: int = RAG_ADD_BATCH_SIZE,
+                       metadatas=None, embeddings=None, ids=None, on_progress=None):
+    """
+    Add chunks to a Chroma collection in a few large add() calls instead of one per chunk.
+    Each add() embeds its whole batch in one pass and writes it in one transaction.
+    Ids default to f"{id_prefix}_{i}"; pass ids to keep existing ones.
+    Pass precomputed embeddings (e.g. from the upload cache) to skip embedding entirely.
+    on_progress(done, total) is called after every batch; by default progress is printed.
+    """
+    total = len(chunks)
+    if total == 0:
+        return 0
+    batch_size = max(1, batch_size)
+
+    for start in range(0, total, batch_size):
+        end = min(start + batch_size, total)
+        kwargs = {
+            "ids": ids[start:end] if ids is not None else [f"{id_prefix}_{i}" for i in range(start, end)],
+            "documents": chunks[start:end],
+        }
+        if metadatas is not None:
+            kwargs["metadatas"] = metadatas[start:end]
+        if embeddings is not None:
+            kwargs["embeddings"] = embeddings[start:end]
+        collection.add(**kwargs)
+
+        if on_progress:
+            on_progress(end, total)
+        else:
+            print(f"📥 Indexed {end}/{total} chunks ({end * 100 // total}%)")
+    return total
+
+
+def snapshot_collection(collection, batch_size: int = RAG_ADD_BATCH_SIZE) -> dict:
+    """
+    Read back ids, documents, metadatas and embeddings of a collection (in batches)
+    so they can be stored in the upload cache and replayed without re-embedding.
+    """
+    snapshot = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        page = collection.get(limit=batch_size, offset=offset,
+                              include=["documents", "metadatas", "embeddings"])
+        snapshot["ids"].extend(page["ids"])
+        snapshot["documents"].extend(page["documents"])
+        snapshot["metadatas"].extend(page["metadatas"])
+        snapshot["embeddings"].extend(page["embeddings"])
+    return snapshot
+
+
+def add_cached_chunks(collection, entry: dict, id_prefix: str | None = None,
+                      batch_size: int = RAG_ADD_BATCH_SIZE) -> int:
+    """
+    Attach a cached chunk set (see upload_cache.UploadCache) to a collection
+    using the stored embeddings, so nothing is re-extracted or re-embedded.
+    With id_prefix the chunks get fresh ids, otherwise the cached ids are reused.
+    """
+    metadatas = entry.get("metadatas")
+    if not metadatas or any(not m for m in metadatas):
+        metadatas = None
+    ids = None if id_prefix else entry.get("ids")
+    return add_chunks_batched(collection, entry["documents"], id_prefix=id_prefix or "chunk",
+                              batch_size=batch_size, metadatas=metadatas,
+                              embeddings=entry.get("embeddings"), ids=ids,
+                              on_progress=lambda done, total: None)
@@ -0,0 +1,88 @@
+# session_store.py
+import os
+import time
+import sqlite3
+import threading
+
+# Sessions unused for this long are reaped (chunks, upload, history); checked every interval
+RAG_SESSION_TTL = float(os.getenv("RAG_SESSION_TTL_HOURS", "72")) * 3600
+RAG_REAPER_INTERVAL = float(os.getenv("RAG_REAPER_INTERVAL", "600"))  # seconds
+
+
+class SessionStore:
+    """
+    Registry of RAG sessions in a small SQLite file: which upload belongs to a
+    session, how many chunks it has in the shared collection and when it was last
+    used. legacy=1 marks old sessions that still live in their own rag_db/<id> DB.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                filename TEXT,
+                upload_path TEXT,
+                num_chunks INTEGER DEFAULT 0,
+                legacy INTEGER DEFAULT 0,
+                created_at REAL,
+                last_access REAL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions(last_access)")
+        self._conn.commit()
+
+    def _row(self, row) -> dict:
+        keys = ("session_id", "filename", "upload_path", "num_chunks", "legacy", "created_at", "last_access")
+        return dict(zip(keys, row))
+
+    def create(self, session_id: str, filename: str = None, upload_path: str = None,
+               num_chunks: int = 0, legacy: bool = False):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, filename, upload_path, num_chunks, int(legacy), now, now))
+            self._conn.commit()
+
+    def set_num_chunks(self, session_id: str, num_chunks: int):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET num_chunks = ? WHERE session_id = ?", (num_chunks, session_id))
+            self._conn.commit()
+
+    def get(self, session_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def touch(self, session_id: str) -> bool:
+        """Mark a session as used now. Returns False if it isn't registered."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def expired(self, ttl: float, now: float | None = None) -> list:
+        cutoff = (now or time.time()) - ttl
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM sessions WHERE last_access < ? ORDER BY last_access", (cutoff,)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
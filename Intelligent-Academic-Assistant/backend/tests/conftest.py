@@ -0,0 +1,8 @@
+# conftest.py
+import os
+import sys
+
+# backend.py puts "Agentic RAG" on sys.path; the tests import the flat modules the same way
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "Agentic RAG"))
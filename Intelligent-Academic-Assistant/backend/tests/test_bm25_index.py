@@ -0,0 +1,38 @@
+# test_bm25_index.py
+from bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_keeps_course_codes_together():
+    assert tokenize("CS-101 covers O(n) and C++") == ["cs-101", "covers", "o", "n", "and", "c++"]
+
+
+def test_rrf_rewards_ids_ranked_high_by_both():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]])
+    assert fused[0] == "b"
+    assert fused.index("c") < fused.index("a")   # 2nd + 3rd beats a single 1st
+    assert set(fused) == {"a", "b", "c", "d"}
+
+
+def test_rrf_single_ranking_is_unchanged():
+    assert reciprocal_rank_fusion([["x", "y", "z"]]) == ["x", "y", "z"]
+
+
+def test_search_ranks_matching_docs_and_filters_sources():
+    index = BM25Index()
+    index.add("1", "binary search trees and balancing", source="ds.pdf")
+    index.add("2", "hash tables", source="ds.pdf")
+    index.add("3", "binary search on sorted arrays binary", source="algo.pdf")
+    assert [d for d, _ in index.search("binary search")] == ["3", "1"]
+    assert [d for d, _ in index.search("binary", source_pred=lambda s: s == "ds.pdf")] == ["1"]
+
+
+def test_remove_and_save_load_round_trip(tmp_path):
+    index = BM25Index()
+    index.add("1", "gradient descent")
+    index.add("2", "stochastic gradient descent")
+    index.remove("1")
+    path = str(tmp_path / "bm25_index.pkl")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert len(loaded) == 1
+    assert [d for d, _ in loaded.search("gradient")] == ["2"]
@@ -0,0 +1,118 @@
+# test_context_packing.py
+import threading
+
+import pytest
+
+import context_packing
+from context_packing import merge_overlapping, pack_context, stitch
+
+MODEL = "no-tokenizer:test"   # no MODEL_TOKENIZERS entry, so tokens are estimated
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    monkeypatch.delenv("CONTEXT_TOKENIZER", raising=False)
+    monkeypatch.setattr(context_packing, "_counters", {})
+
+
+def chunk(text, source="notes.pdf", chunk_id=None, page=None):
+    meta = {"source": source}
+    if chunk_id is not None:
+        meta["chunk_id"] = str(chunk_id)
+    if page is not None:
+        meta["page"] = page
+    return {"text": text, "meta": meta}
+
+
+def test_stitch_drops_shared_words():
+    assert stitch("the quick brown fox", "brown fox jumps") == "the quick brown fox jumps"
+    assert stitch("alpha", "beta") == "alpha\nbeta"
+
+
+def test_merge_joins_neighbours_and_keeps_best_rank():
+    merged = merge_overlapping([chunk("c d e f", chunk_id=2), chunk("other", source="b.pdf"),
+                                chunk("a b c d", chunk_id=1), chunk("c d e f", chunk_id=2)])
+    assert [m["text"] for m in merged] == ["a b c d e f", "other"]
+    assert merged[0]["chunk_ids"] == ["1", "2"]
+    assert merged[0]["rank"] == 0
+
+
+def test_pack_stays_under_budget_and_skips_what_does_not_fit():
+    retrieved = [chunk("x" * 200, chunk_id=1), chunk("y" * 400, chunk_id=5), chunk("z" * 40, chunk_id=9)]
+    packed = pack_context(retrieved, MODEL, budget_tokens=100)
+    assert packed["tokens"] <= 100
+    assert [i["chunk_ids"] for i in packed["items"]] == [["1"], ["9"]]
+    assert packed["dropped"] == 1
+    assert "[[notes.pdf_chunk1]]" in packed["context"]
+
+
+def test_oversized_best_passage_is_truncated_to_budget():
+    packed = pack_context([chunk("word " * 400, chunk_id=1, page=3)], MODEL, budget_tokens=50)
+    assert len(packed["items"]) == 1
+    assert packed["tokens"] <= 50
+    assert packed["context"].startswith("[[notes.pdf_chunk1 p.3]]")
+
+
+class UnevenCounter:
+    """Words starting with 'X' are 10 tokens each, everything else 1 per word."""
+    exact = True
+
+    def count(self, text):
+        return sum(10 if w.startswith("X") else 1 for w in text.split()) + text.count("\n\n")
+
+
+def test_truncation_respects_uneven_token_density(monkeypatch):
+    monkeypatch.setattr(context_packing, "get_token_counter", lambda model: UnevenCounter())
+    text = " ".join(["X1"] * 20 + ["a"] * 40)   # dense head: a per-character cut overshoots
+    packed = pack_context([chunk(text, chunk_id=1), chunk("tail words", chunk_id=7)], MODEL,
+                          budget_tokens=20, header_fn=None)
+    assert packed["tokens"] <= 20
+    assert packed["tokens"] == UnevenCounter().count(packed["context"])
+    assert packed["context"] == "X1\n\ntail words\n\n"   # the next passage still fits after the cut
+
+
+def test_first_word_over_budget_packs_nothing(monkeypatch):
+    monkeypatch.setattr(context_packing, "get_token_counter", lambda model: UnevenCounter())
+    packed = pack_context([chunk("X1 a a", chunk_id=1)], MODEL, budget_tokens=5, header_fn=None)
+    assert packed == {"context": "", "items": [], "tokens": 0, "dropped": 1}
+
+
+def test_packed_tokens_match_the_context():
+    retrieved = [chunk("alpha " * 20, chunk_id=1), chunk("beta " * 20, chunk_id=5)]
+    packed = pack_context(retrieved, MODEL, budget_tokens=1000)
+    counter = context_packing.get_token_counter(MODEL)
+    assert packed["context"] == "".join(
+        f"[[notes.pdf_chunk{c}]]\n{w.strip()}\n\n" for c, w in (("1", "alpha " * 20), ("5", "beta " * 20)))
+    assert packed["tokens"] == sum(counter.count(f"[[notes.pdf_chunk{c}]]\n{w.strip()}\n\n")
+                                   for c, w in (("1", "alpha " * 20), ("5", "beta " * 20)))
+
+
+def test_slow_tokenizer_load_does_not_block_other_models(monkeypatch):
+    loading, release = threading.Event(), threading.Event()
+
+    class SlowCounter(context_packing.TokenCounter):
+        def __init__(self, model):
+            if model == "slow":
+                loading.set()
+                release.wait(5)
+            super().__init__(model)
+
+    monkeypatch.setattr(context_packing, "TokenCounter", SlowCounter)
+    slow = threading.Thread(target=context_packing.get_token_counter, args=("slow",))
+    slow.start()
+    assert loading.wait(5)
+    fast = []
+    other = threading.Thread(target=lambda: fast.append(context_packing.get_token_counter(MODEL)))
+    other.start()
+    other.join(2)
+    release.set()
+    slow.join()
+    assert fast, "counter for another model waited for the slow download"
+    assert "slow" in context_packing._counters
+
+
+def test_fallback_counter_is_created_once():
+    counter = context_packing.get_token_counter(MODEL)
+    assert not counter.exact
+    assert context_packing.get_token_counter(MODEL) is counter
+    assert counter.count("abcdefgh") == 3
@@ -0,0 +1,70 @@
+# test_history_store.py
+import json
+import threading
+
+from history_store import HistoryStore
+
+
+def turns(n):
+    messages = []
+    for i in range(n):
+        messages += [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]
+    return messages
+
+
+def test_recent_returns_last_turns_in_order(tmp_path):
+    store = HistoryStore(str(tmp_path), read_block=64)   # small blocks: the tail spans several reads
+    for i in range(50):
+        store.append("s", turns(50)[2 * i:2 * i + 2])
+    recent = store.recent("s", max_turns=3, max_tokens=None)
+    assert [m["content"] for m in recent] == ["q47", "a47", "q48", "a48", "q49", "a49"]
+
+
+def test_recent_trims_to_token_budget_and_starts_with_user(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("s", [{"role": "user", "content": "x" * 400}, {"role": "assistant", "content": "short"},
+                       {"role": "user", "content": "next"}, {"role": "assistant", "content": "reply"}])
+    recent = store.recent("s", max_turns=6, max_tokens=20)
+    assert [m["content"] for m in recent] == ["next", "reply"]
+
+
+def test_recent_skips_torn_lines(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("s", turns(1))
+    with open(store.path("s"), "a") as f:
+        f.write('{"role": "user", "cont')
+    assert [m["content"] for m in store.recent("s", max_tokens=None)] == ["q0", "a0"]
+
+
+def test_unknown_session_is_empty(tmp_path):
+    assert HistoryStore(str(tmp_path)).recent("missing") == []
+
+
+def test_legacy_history_is_migrated_once_under_concurrency(tmp_path):
+    with open(tmp_path / "s.json", "w") as f:
+        json.dump(turns(2), f)
+    store = HistoryStore(str(tmp_path))
+    errors = []
+
+    def read():
+        try:
+            store.recent("s", max_tokens=None)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert not (tmp_path / "s.json").exists()
+    assert [m["content"] for m in store.recent("s", max_tokens=None)] == ["q0", "a0", "q1", "a1"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["s.jsonl"]
+
+
+def test_delete_removes_history(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append("s", turns(1))
+    store.delete("s")
+    assert store.recent("s") == []
@@ -0,0 +1,127 @@
+# test_llm_scheduler.py
+import asyncio
+import threading
+
+from llm_scheduler import LLMScheduler, INTERACTIVE, BATCH
+
+
+class FakeClient:
+    """Stands in for ollama.Client: chat() blocks until released, then echoes the prompt."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.calls.append(messages[-1]["content"])
+        if stream:
+            return iter({"message": {"content": t}} for t in ["a", "", "b"])
+        self.release.wait(5)
+        return {"message": {"content": messages[-1]["content"].upper()}}
+
+
+def make_scheduler(max_concurrency=1):
+    scheduler = LLMScheduler(max_concurrency=max_concurrency)
+    scheduler._client = FakeClient()
+    return scheduler
+
+
+def block_slots(scheduler):
+    """Occupy every worker so later jobs stay queued; set the returned event to free them."""
+    gate, started = threading.Event(), threading.Semaphore(0)
+
+    def hold():
+        started.release()
+        gate.wait(5)
+
+    for _ in range(scheduler.max_concurrency):
+        scheduler.run(hold)
+    for _ in range(scheduler.max_concurrency):
+        assert started.acquire(timeout=5)
+    return gate
+
+
+def msg(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_identical_requests_are_merged():
+    scheduler = make_scheduler()
+    gate = block_slots(scheduler)
+    first = scheduler.submit("m", msg("hi"))
+    second = scheduler.submit("m", msg("hi"))
+    other = scheduler.submit("m", msg("bye"))
+    assert first is second and first is not other
+    gate.set()
+    scheduler.client.release.set()
+    assert second.result(5)["message"]["content"] == "HI"
+    assert other.result(5)["message"]["content"] == "BYE"
+    assert scheduler.client.calls.count("hi") == 1
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_interactive_jobs_run_before_batch():
+    scheduler = make_scheduler()
+    gate = block_slots(scheduler)
+    order = []
+    done = [scheduler.run(lambda: order.append("batch"), BATCH),
+            scheduler.run(lambda: order.append("interactive"), INTERACTIVE)]
+    gate.set()
+    for future in done:
+        future.result(5)
+    assert order == ["interactive", "batch"]
+
+
+def test_merged_request_is_promoted_to_the_better_priority():
+    scheduler = make_scheduler()
+    gate = block_slots(scheduler)
+    scheduler.client.release.set()
+    order = []
+    batch = scheduler.run(lambda: order.append("other batch"), BATCH)
+    scheduler.submit("m", msg("x"), BATCH).add_done_callback(lambda f: order.append("x"))
+    scheduler.submit("m", msg("x"), INTERACTIVE)
+    gate.set()
+    batch.result(5)
+    assert order[0] == "x"
+
+
+def test_cancelling_one_merged_caller_keeps_the_other():
+    scheduler = make_scheduler()
+
+    async def main():
+        gate = block_slots(scheduler)
+        first = asyncio.ensure_future(scheduler.achat("m", msg("q")))
+        second = asyncio.ensure_future(scheduler.achat("m", msg("q")))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0.05)
+        gate.set()
+        scheduler.client.release.set()
+        return await asyncio.wait_for(second, 5), first
+
+    reply, first = asyncio.run(main())
+    assert reply["message"]["content"] == "Q"
+    assert first.cancelled()
+    assert scheduler.client.calls == ["q"]
+
+
+def test_queued_request_without_callers_never_runs():
+    scheduler = make_scheduler()
+
+    async def main():
+        gate = block_slots(scheduler)
+        task = asyncio.ensure_future(scheduler.achat("m", msg("gone")))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        gate.set()
+        await asyncio.wrap_future(scheduler.run(lambda: None))
+
+    asyncio.run(main())
+    assert scheduler.client.calls == []
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_stream_yields_non_empty_tokens():
+    scheduler = make_scheduler()
+    assert list(scheduler.stream("m", msg("s"))) == ["a", "b"]
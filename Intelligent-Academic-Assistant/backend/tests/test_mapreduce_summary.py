@@ -0,0 +1,43 @@
+# test_mapreduce_summary.py
+import os
+import asyncio
+
+from mapreduce_summary import SummaryCache, group_chunks, mapreduce_summarize
+
+
+def test_group_chunks_respects_max_chars():
+    assert group_chunks(["aaa", "bb", "cccc", "d"], max_chars=5) == [["aaa", "bb"], ["cccc", "d"]]
+    assert group_chunks(["x" * 10, "y"], max_chars=5) == [["x" * 10], ["y"]]
+
+
+def test_second_summary_reuses_cached_groups(tmp_path):
+    calls = []
+
+    async def chat(model, messages):
+        calls.append(messages[0]["content"])
+        return f"summary {len(calls)}"
+
+    cache = SummaryCache(str(tmp_path))
+    chunks = ["a" * 100, "b" * 100, "c" * 100]
+    first = asyncio.run(mapreduce_summarize(chunks, "q1", "m", chat, cache, group_chars=150))
+    second = asyncio.run(mapreduce_summarize(chunks, "q2", "m", chat, cache, group_chars=150))
+    assert first["groups"] == 3 and first["cached_groups"] == 0
+    assert second["cached_groups"] == second["groups"] == 3
+    assert len(calls) == 3 + 1 + 1   # map once, one reduce per query
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = SummaryCache(str(tmp_path))
+    keys = [cache.key("m", "map", [str(i)]) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, "x" * 80)
+        os.utime(cache._path(key), (1000 + i, 1000 + i))   # keys[0] oldest
+    entry_size = os.path.getsize(cache._path(keys[0]))
+    assert cache.get(keys[0]) is not None   # a hit makes it the most recent
+
+    cache.max_bytes = entry_size * 4   # the fifth entry goes over: evict down to 90%
+    cache.put(cache.key("m", "map", ["new"]), "x" * 80)
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None and cache.get(keys[2]) is None
+    assert cache.get(keys[3]) is not None
+    assert sum(size for _, size, _ in cache._entries()) <= cache.max_bytes * 0.9
@@ -0,0 +1,38 @@
+# test_pdf_extract.py
+import pytest
+
+from pdf_extract import iter_page_chunks
+
+
+def words(n, prefix="w"):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def test_chunks_slide_with_overlap():
+    chunks = list(iter_page_chunks([words(10)], chunk_size=4, overlap=1))
+    assert [c["text"] for c in chunks] == ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9", "w9"]
+    assert all(c["page"] == c["page_end"] == 1 for c in chunks)
+
+
+def test_char_offset_points_into_first_page():
+    page = "  alpha beta\ngamma delta"
+    chunks = list(iter_page_chunks([page], chunk_size=2, overlap=0))
+    for chunk in chunks:
+        assert page[chunk["char_offset"]:].startswith(chunk["text"])
+    assert [c["text"] for c in chunks] == ["alpha beta", "gamma delta"]
+
+
+def test_chunk_spanning_pages_keeps_both_page_numbers():
+    chunks = list(iter_page_chunks(["a b c ", "", "d e f"], chunk_size=4, overlap=0))
+    assert chunks[0] == {"text": "a b c d", "page": 1, "page_end": 3, "char_offset": 0}
+    assert chunks[1]["text"] == "e f"
+    assert chunks[1]["page"] == chunks[1]["page_end"] == 3
+
+
+def test_blank_input_yields_nothing():
+    assert list(iter_page_chunks(["", "   \n"])) == []
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        list(iter_page_chunks(["a b"], chunk_size=5, overlap=5))
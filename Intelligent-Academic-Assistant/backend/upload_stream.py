@@ -0,0 +1,50 @@
+# upload_stream.py
+import os
+import hashlib
+
+# Uploads larger than this are rejected with 413; they're copied UPLOAD_CHUNK_BYTES at a time
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "200")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Multipart framing around the file, allowed on top of UPLOAD_MAX_BYTES in Content-Length
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+        self.max_bytes = max_bytes
+
+
+def content_length_too_large(content_length: str | None, max_bytes: int = UPLOAD_MAX_BYTES) -> bool:
+    """True if a request's Content-Length alone proves the upload is over the limit."""
+    try:
+        return int(content_length) > max_bytes + UPLOAD_FORM_OVERHEAD
+    except (TypeError, ValueError):
+        return False
+
+
+def copy_upload(src, dest_path: str, max_bytes: int = UPLOAD_MAX_BYTES,
+                chunk_bytes: int = UPLOAD_CHUNK_BYTES) -> tuple:
+    """
+    Stream a file object to dest_path in fixed-size chunks, hashing as it goes, so memory
+    stays at one chunk whatever the file size. Blocking: run it in a worker thread.
+    Returns (size, sha256 hex). Raises UploadTooLarge (and removes the partial file).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, "wb") as out:
+            while True:
+                chunk = src.read(chunk_bytes)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return size, digest.hexdigest()